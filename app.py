@@ -72,6 +72,10 @@ with app.app_context():
     import models
     db.create_all()
     
+    # Bring tables of existing databases up to date (columns, indexes)
+    from migrations import run_migrations
+    run_migrations()
+    
     # Create default master user if not exists
     from models import User
     from werkzeug.security import generate_password_hash
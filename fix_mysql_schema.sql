@@ -1,5 +1,9 @@
 -- Fix MySQL Schema - Add missing columns to omada_config table
 -- Execute this script if you get errors about missing columns
+--
+-- The application now applies these changes (and the lookup indexes) by
+-- itself at startup, see migrations.py; "flask --app main migrate" does the
+-- same by hand. This script is kept for installs managed manually.
 
 USE voucher_system;
 
@@ -62,10 +66,50 @@ DEALLOCATE PREPARE stmt;
 UPDATE admin_site SET assigned_at = CURRENT_TIMESTAMP WHERE assigned_at IS NULL;
 UPDATE vendor_site SET assigned_at = CURRENT_TIMESTAMP WHERE assigned_at IS NULL;
 
+-- Add sync_fingerprint column to voucher_group table if it doesn't exist
+SET @sql = (SELECT IF(
+    (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
+     WHERE table_name = 'voucher_group' 
+     AND column_name = 'sync_fingerprint' 
+     AND table_schema = DATABASE()) > 0,
+    "SELECT 'sync_fingerprint column already exists in voucher_group' as message",
+    "ALTER TABLE voucher_group ADD COLUMN sync_fingerprint VARCHAR(100) AFTER last_sync"
+));
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Add sync lease columns to site_sync_state table if they don't exist
+SET @sql = (SELECT IF(
+    (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
+     WHERE table_name = 'site_sync_state' 
+     AND column_name = 'lock_owner' 
+     AND table_schema = DATABASE()) > 0,
+    "SELECT 'lock_owner column already exists in site_sync_state' as message",
+    "ALTER TABLE site_sync_state ADD COLUMN lock_owner VARCHAR(64), ADD COLUMN lock_expires_at DATETIME"
+));
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Add report column to sync_job table if it doesn't exist
+SET @sql = (SELECT IF(
+    (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
+     WHERE table_name = 'sync_job' 
+     AND column_name = 'report' 
+     AND table_schema = DATABASE()) > 0,
+    "SELECT 'report column already exists in sync_job' as message",
+    "ALTER TABLE sync_job ADD COLUMN report JSON"
+));
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
 -- Show current table structures
 DESCRIBE omada_config;
 DESCRIBE admin_site;
 DESCRIBE vendor_site;
+DESCRIBE voucher_group;
 
 -- Show confirmation message
 SELECT 'MySQL schema update completed successfully!' as status;
\ No newline at end of file
@@ -23,6 +23,9 @@ try:
     # Import routes to register them
     import routes
     
+    # Register the "flask sync-worker" command
+    import sync_worker
+    
     # Ensure the app is available for Gunicorn
     logger.info("Flask app imported successfully")
     
@@ -0,0 +1,191 @@
+import logging
+from datetime import datetime
+
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import (AdminSite, CashRegister, CashRegisterVoucher, OmadaConfig, SalesRollup, SchemaVersion,
+                    SiteSyncState, SyncJob, VendorSite, Voucher, VoucherGroup)
+
+# (version, description, function), applied in version order. db.create_all()
+# creates missing tables with all their columns and indexes; migrations
+# bring tables of existing installs up to date. Every step checks the live
+# schema first, so it is safe to run against a database in any state.
+MIGRATIONS = []
+
+def migration(version: int, description: str):
+    """Register a schema migration"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+def _add_column(model, name: str):
+    """Add a model column to its table if the table doesn't have it yet"""
+    table = model.__table__
+    column = table.columns[name]
+    if name in {c['name'] for c in inspect(db.engine).get_columns(table.name)}:
+        return
+    
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+            if column.default is not None and column.default.is_scalar:
+                # Existing rows get the model default instead of NULL
+                conn.execute(table.update().where(column.is_(None)).values({name: column.default.arg}))
+        logging.info(f"Added column {table.name}.{name}")
+    except Exception:
+        # Another worker may have added it in the meantime
+        if name not in {c['name'] for c in inspect(db.engine).get_columns(table.name)}:
+            raise
+
+def _create_index(model, name: str):
+    """Create one of a model's indexes if the table doesn't have it yet"""
+    table = model.__table__
+    index = next(index for index in table.indexes if index.name == name)
+    if name in {i['name'] for i in inspect(db.engine).get_indexes(table.name)}:
+        return
+    
+    try:
+        index.create(bind=db.engine)
+        logging.info(f"Created index {name} on {table.name}")
+    except Exception:
+        # Another worker may have created it in the meantime
+        if name not in {i['name'] for i in inspect(db.engine).get_indexes(table.name)}:
+            raise
+
+@migration(1, 'Columns added to omada_config, admin_site and vendor_site after release')
+def add_early_columns():
+    _add_column(OmadaConfig, 'refresh_token')
+    _add_column(OmadaConfig, 'is_active')
+    _add_column(AdminSite, 'assigned_at')
+    _add_column(VendorSite, 'assigned_at')
+    with db.engine.begin() as conn:
+        now = datetime.utcnow()
+        conn.execute(AdminSite.__table__.update().where(AdminSite.assigned_at.is_(None)).values(assigned_at=now))
+        conn.execute(VendorSite.__table__.update().where(VendorSite.assigned_at.is_(None)).values(assigned_at=now))
+
+@migration(2, 'Sync fingerprint, sync lease and sync job report columns')
+def add_sync_columns():
+    _add_column(VoucherGroup, 'sync_fingerprint')
+    _add_column(SiteSyncState, 'lock_owner')
+    _add_column(SiteSyncState, 'lock_expires_at')
+    _add_column(SyncJob, 'report')
+
+@migration(3, 'Indexes for sync, history, report and access check lookups')
+def add_lookup_indexes():
+    _create_index(VoucherGroup, 'ix_voucher_group_omada_group_id')
+    _create_index(VoucherGroup, 'ix_voucher_group_site_created')
+    _create_index(CashRegister, 'ix_cash_register_site_period_end')
+    _create_index(AdminSite, 'ix_admin_site_admin_site')
+    _create_index(VendorSite, 'ix_vendor_site_vendor_site')
+
+@migration(4, 'Voucher table: re-read every group on the next sync to fill it')
+def fill_voucher_table():
+    # Sync only reads groups whose counters changed; forgetting the
+    # fingerprints makes the next sync of each site read all of them
+    with db.engine.begin() as conn:
+        conn.execute(VoucherGroup.__table__.update().values(sync_fingerprint=None))
+
+@migration(5, 'Cash register voucher ledger filled from past closings')
+def fill_cash_register_ledger():
+    # Replay closings oldest first; a voucher counted twice by the old
+    # JSON-based check stays with the closing that took it first
+    seen = {(site_id, voucher_id) for site_id, voucher_id in
+            db.session.query(CashRegisterVoucher.site_id, CashRegisterVoucher.omada_voucher_id)}
+    rows = []
+    closings = db.session.query(CashRegister.id, CashRegister.site_id, CashRegister.voucher_data).order_by(CashRegister.id)
+    for cash_register_id, site_id, voucher_data in closings.yield_per(200):
+        for v in voucher_data or []:
+            if not v.get('id') or (site_id, v['id']) in seen:
+                continue
+            seen.add((site_id, v['id']))
+            rows.append({'cash_register_id': cash_register_id, 'site_id': site_id,
+                         'omada_voucher_id': v['id'], 'code': v.get('code')})
+    
+    with db.engine.begin() as conn:
+        for start in range(0, len(rows), 500):
+            conn.execute(CashRegisterVoucher.__table__.insert(), rows[start:start + 500])
+    logging.info(f"Recorded {len(rows)} closed vouchers in the cash register ledger")
+
+@migration(6, 'Sales rollups computed from existing voucher groups')
+def fill_sales_rollups():
+    from utils import rebuild_sales_rollups
+    logging.info(f"Wrote {rebuild_sales_rollups()} sales rollup rows")
+
+@migration(7, 'Sales rollup in_use columns, so dashboards keep counting used + expired')
+def add_sales_rollup_in_use():
+    from utils import rebuild_sales_rollups
+    _add_column(SalesRollup, 'vouchers_in_use')
+    _add_column(SalesRollup, 'revenue_in_use')
+    rebuild_sales_rollups()
+
+@migration(8, 'One voucher group per site and controller group')
+def unique_voucher_group_per_site():
+    from utils import rebuild_sales_rollups
+    
+    # A sync racing a generation could import a group a second time; keep
+    # the first row of each and move the vouchers of the others onto it
+    keep = {}
+    extra = {}
+    rows = db.session.query(VoucherGroup.id, VoucherGroup.site_id, VoucherGroup.omada_group_id).filter(
+        VoucherGroup.omada_group_id.isnot(None)).order_by(VoucherGroup.id)
+    for group_id, site_id, omada_group_id in rows:
+        keep_id = keep.setdefault((site_id, omada_group_id), group_id)
+        if keep_id != group_id:
+            extra[group_id] = keep_id
+    db.session.rollback()
+    
+    if extra:
+        with db.engine.begin() as conn:
+            for group_id, keep_id in extra.items():
+                conn.execute(Voucher.__table__.update().where(Voucher.voucher_group_id == group_id)
+                             .values(voucher_group_id=keep_id))
+            conn.execute(VoucherGroup.__table__.delete().where(VoucherGroup.id.in_(list(extra))))
+        rebuild_sales_rollups()
+        logging.info(f"Removed {len(extra)} duplicated voucher groups")
+    _create_index(VoucherGroup, 'uq_voucher_group_site_omada_group')
+
+def pending_migrations():
+    """Migrations not yet recorded in schema_version, in order"""
+    applied = {version for (version,) in db.session.query(SchemaVersion.version)}
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m[0]) if m[0] not in applied]
+
+def run_migrations():
+    """Apply pending migrations in order; returns the versions applied"""
+    applied = []
+    for version, description, func in pending_migrations():
+        logging.info(f"Applying schema migration {version}: {description}")
+        func()
+        try:
+            db.session.add(SchemaVersion(version=version, description=description, applied_at=datetime.utcnow()))
+            db.session.commit()
+        except IntegrityError:
+            # Recorded by another worker starting at the same time
+            db.session.rollback()
+        applied.append(version)
+    return applied
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='Only list applied and pending migrations.')
+def migrate_command(status):
+    """Bring the database schema up to date"""
+    if status:
+        for row in SchemaVersion.query.order_by(SchemaVersion.version):
+            click.echo(f"applied  {row.version}: {row.description} ({row.applied_at:%Y-%m-%d %H:%M})")
+        for version, description, _ in pending_migrations():
+            click.echo(f"pending  {version}: {description}")
+        return
+    
+    applied = run_migrations()
+    click.echo(f"Applied migrations: {', '.join(map(str, applied))}" if applied else "Schema is up to date")
+
+@app.cli.command('rebuild-sales-rollups')
+@click.option('--site', 'site_id', type=int, help='Only rebuild this site (database id).')
+def rebuild_sales_rollups_command(site_id):
+    """Recompute sales rollups from voucher groups (e.g. after changing plan prices)"""
+    from utils import rebuild_sales_rollups
+    click.echo(f"Wrote {rebuild_sales_rollups(site_id)} sales rollup rows")
@@ -41,6 +41,8 @@ class Site(db.Model):
     voucher_groups = db.relationship('VoucherGroup', back_populates='site', cascade='all, delete-orphan')
 
 class AdminSite(db.Model):
+    __table_args__ = (db.Index('ix_admin_site_admin_site', 'admin_id', 'site_id'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
@@ -51,6 +53,8 @@ class AdminSite(db.Model):
     site = db.relationship('Site', back_populates='admin_sites')
 
 class VendorSite(db.Model):
+    __table_args__ = (db.Index('ix_vendor_site_vendor_site', 'vendor_id', 'site_id'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     vendor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
@@ -81,18 +85,24 @@ class VoucherPlan(db.Model):
     voucher_groups = db.relationship('VoucherGroup', back_populates='plan', cascade='all, delete-orphan')
 
 class VoucherGroup(db.Model):
+    __table_args__ = (
+        db.Index('ix_voucher_group_site_created', 'site_id', 'created_at'),
+        db.Index('uq_voucher_group_site_omada_group', 'site_id', 'omada_group_id', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
     plan_id = db.Column(db.Integer, db.ForeignKey('voucher_plan.id'), nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    omada_group_id = db.Column(db.String(100))  # ID from Omada Controller
+    omada_group_id = db.Column(db.String(100), index=True)  # ID from Omada Controller
     voucher_codes = db.Column(JSON)  # List of voucher codes
     unused_count = db.Column(db.Integer, default=0)
     used_count = db.Column(db.Integer, default=0)
     in_use_count = db.Column(db.Integer, default=0)
     expired_count = db.Column(db.Integer, default=0)
     last_sync = db.Column(db.DateTime)
+    sync_fingerprint = db.Column(db.String(100))  # Group list counters at last detail sync
     total_value = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='generated')  # generated, used, expired
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -101,6 +111,47 @@ class VoucherGroup(db.Model):
     site = db.relationship('Site', back_populates='voucher_groups')
     plan = db.relationship('VoucherPlan', back_populates='voucher_groups')
     created_by = db.relationship('User', back_populates='created_vouchers')
+    vouchers = db.relationship('Voucher', back_populates='voucher_group', cascade='all, delete-orphan')
+
+class Voucher(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('site_id', 'omada_voucher_id', name='uq_voucher_site_omada_voucher'),
+        db.Index('ix_voucher_site_status_changed', 'site_id', 'status', 'status_changed_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
+    voucher_group_id = db.Column(db.Integer, db.ForeignKey('voucher_group.id'), nullable=False, index=True)
+    omada_voucher_id = db.Column(db.String(100), nullable=False)  # ID from Omada Controller
+    code = db.Column(db.String(50), nullable=False, index=True)
+    status = db.Column(db.Integer, nullable=False, default=0)  # Omada status: 0 unused, 1 in use, 2 expired
+    status_changed_at = db.Column(db.DateTime)  # When sync first saw the current status
+    used_at = db.Column(db.DateTime)  # When sync first saw it in use (or already expired)
+    expired_at = db.Column(db.DateTime)  # When sync first saw it expired
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    site = db.relationship('Site', backref=db.backref('vouchers', cascade='all, delete-orphan'))
+    voucher_group = db.relationship('VoucherGroup', back_populates='vouchers')
+
+class SalesRollup(db.Model):
+    """Voucher group totals per site, plan, vendor and day of group creation, kept up to date incrementally"""
+    __table_args__ = (db.UniqueConstraint('site_id', 'day', 'plan_id', 'vendor_id', name='uq_sales_rollup_site_day_plan_vendor'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    plan_id = db.Column(db.Integer, db.ForeignKey('voucher_plan.id'), nullable=False)
+    vendor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # VoucherGroup.created_by_id
+    vouchers_generated = db.Column(db.Integer, nullable=False, default=0)
+    vouchers_sold = db.Column(db.Integer, nullable=False, default=0)  # expired + used + in_use
+    vouchers_in_use = db.Column(db.Integer, nullable=False, default=0)  # in_use part of vouchers_sold
+    revenue = db.Column(db.Float, nullable=False, default=0)  # vouchers_sold * plan price when sold
+    revenue_in_use = db.Column(db.Float, nullable=False, default=0)  # in_use part of revenue
+    
+    # Relationships
+    plan = db.relationship('VoucherPlan')
+    vendor = db.relationship('User')
 
 class OmadaConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -116,6 +167,8 @@ class OmadaConfig(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class CashRegister(db.Model):
+    __table_args__ = (db.Index('ix_cash_register_site_period_end', 'site_id', 'period_end'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
     closed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -135,3 +188,86 @@ class CashRegister(db.Model):
     # Relationships
     site = db.relationship('Site', backref='cash_registers')
     closed_by = db.relationship('User', backref='cash_registers')
+    closed_vouchers = db.relationship('CashRegisterVoucher', back_populates='cash_register', cascade='all, delete-orphan')
+
+class CashRegisterVoucher(db.Model):
+    """Ledger of vouchers already counted in a cash register closing, one row per voucher"""
+    __table_args__ = (db.UniqueConstraint('site_id', 'omada_voucher_id', name='uq_cash_register_voucher_site_voucher'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    cash_register_id = db.Column(db.Integer, db.ForeignKey('cash_register.id'), nullable=False, index=True)
+    site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
+    omada_voucher_id = db.Column(db.String(100), nullable=False)  # ID from Omada Controller
+    code = db.Column(db.String(50))
+    
+    # Relationships
+    cash_register = db.relationship('CashRegister', back_populates='closed_vouchers')
+
+class SiteSyncState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    site_id = db.Column(db.Integer, db.ForeignKey('site.id'), unique=True, nullable=False)
+    status = db.Column(db.String(20), default='idle')  # idle, running, ok, error
+    next_sync_at = db.Column(db.DateTime)  # Site is due once this has passed (UTC)
+    sync_interval = db.Column(db.Integer)  # Current adaptive interval in seconds
+    consecutive_failures = db.Column(db.Integer, default=0)
+    last_changes = db.Column(db.Integer)  # Groups changed in the last successful sync
+    last_started_at = db.Column(db.DateTime)
+    last_finished_at = db.Column(db.DateTime)
+    last_success_at = db.Column(db.DateTime)
+    last_duration = db.Column(db.Float)  # seconds
+    last_error = db.Column(Text)
+    lock_owner = db.Column(db.String(64))  # Token of the worker holding the sync lease
+    lock_expires_at = db.Column(db.DateTime)  # Lease is free once this has passed (UTC)
+    
+    # Relationships
+    site = db.relationship('Site', backref=db.backref('sync_state', uselist=False, cascade='all, delete-orphan'))
+
+class SyncJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(20), nullable=False)  # vouchers, sites, all_sites
+    site_id = db.Column(db.Integer, db.ForeignKey('site.id'))  # Only for voucher jobs
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, error
+    groups_seen = db.Column(db.Integer, default=0)
+    groups_synced = db.Column(db.Integer, default=0)
+    groups_changed = db.Column(db.Integer, default=0)
+    groups_imported = db.Column(db.Integer, default=0)
+    sites_synced = db.Column(db.Integer, default=0)
+    error = db.Column(Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)  # seconds
+    report = db.Column(JSON)  # Per-site results of an all_sites job
+    
+    # Relationships
+    site = db.relationship('Site', backref=db.backref('sync_jobs', cascade='all, delete-orphan'))
+    requested_by = db.relationship('User', backref='sync_jobs')
+    
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'error')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'site_id': self.site_id,
+            'status': self.status,
+            'groups_seen': self.groups_seen or 0,
+            'groups_synced': self.groups_synced or 0,
+            'groups_changed': self.groups_changed or 0,
+            'groups_imported': self.groups_imported or 0,
+            'sites_synced': self.sites_synced or 0,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration': self.duration,
+            'report': self.report
+        }
+
+class SchemaVersion(db.Model):
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,14 +1,43 @@
 import requests
+import functools
+import inspect
 import json
 import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterator, List, Optional
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from app import db
 from models import OmadaConfig
+from omada_cache import create_cache_backend
 import os
 
-class OmadaAPI:
+class TokenCache:
+    """Process-wide holder for the controller configuration and access token.
+
+    Shared by every OmadaAPI instance so a valid token never touches the
+    database (apart from a periodic check of the config row's version, so
+    a config saved by another process is picked up). Refreshes are
+    single-flight: one thread refreshes while the others wait on
+    ``refresh_lock`` and reuse its token.
+    """
+
     def __init__(self):
+        self.refresh_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything so the next call reloads from the database"""
+        self.loaded = False
+        self.config_version = None
+        self.config_checked_at = 0.0
         self.base_url = os.environ.get("OMADA_CONTROLLER_URL", "https://omada.camstm.com:8043")
         self.client_id = os.environ.get("OMADA_CLIENT_ID")
         self.client_secret = os.environ.get("OMADA_CLIENT_SECRET")
@@ -16,8 +45,326 @@ class OmadaAPI:
         self.access_token = None
         self.refresh_token = None
         self.token_expires_at = None
-        self.session = requests.Session()
-        self.session.verify = False  # For development, should be True in production
+
+    def is_valid(self) -> bool:
+        """Check if the cached token can be used without a refresh"""
+        if not self.access_token or not self.token_expires_at:
+            return False
+        return datetime.utcnow() < self.token_expires_at - timedelta(minutes=5)
+
+    def config_check_due(self) -> bool:
+        """Whether to look for a config change made by another process"""
+        return self.loaded and time.monotonic() - self.config_checked_at >= CONFIG_CHECK_INTERVAL
+
+
+def _shared_field(name: str):
+    """Expose a TokenCache field as an OmadaAPI attribute"""
+    return property(
+        lambda self: getattr(self._tokens, name),
+        lambda self, value: setattr(self._tokens, name, value)
+    )
+
+
+# Seconds between checks for a controller config saved by another process
+# (the config page only resets the tokens of the worker that served it)
+CONFIG_CHECK_INTERVAL = float(os.environ.get("OMADA_CONFIG_CHECK_INTERVAL", "5"))
+
+# Shared by all OmadaAPI instances in this process
+token_cache = TokenCache()
+
+# Controller error codes that mean our token is no longer accepted
+TOKEN_ERROR_CODES = (-44111, -44112)
+
+# Largest pageSize accepted by every paged Omada endpoint
+MAX_PAGE_SIZE = 1000
+
+# Concurrent page requests when walking the vouchers of one large group
+GROUP_PAGE_WORKERS = int(os.environ.get("OMADA_GROUP_PAGE_WORKERS", "4"))
+
+# Concurrent per-group detail requests during a voucher sync
+SYNC_CONCURRENCY = int(os.environ.get("OMADA_SYNC_CONCURRENCY", "8"))
+
+def _env_timeout(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+# (connect, read) timeouts in seconds per endpoint class
+CONNECT_TIMEOUT = _env_timeout("OMADA_CONNECT_TIMEOUT", 5)
+TIMEOUTS = {
+    'auth': (CONNECT_TIMEOUT, _env_timeout("OMADA_AUTH_TIMEOUT", 15)),
+    'read': (CONNECT_TIMEOUT, _env_timeout("OMADA_READ_TIMEOUT", 10)),
+    'write': (CONNECT_TIMEOUT, _env_timeout("OMADA_WRITE_TIMEOUT", 30)),
+}
+
+# Retries for idempotent GETs (connection failures are retried for any method)
+MAX_RETRIES = int(os.environ.get("OMADA_MAX_RETRIES", "2"))
+RETRY_BACKOFF = float(os.environ.get("OMADA_RETRY_BACKOFF", "0.5"))
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Keep-alive connections kept per controller host
+POOL_SIZE = int(os.environ.get("OMADA_POOL_SIZE", str(max(10, SYNC_CONCURRENCY * 2))))
+
+# Requests this process sends to the controller at once, across all threads
+# and sites; the rest wait for a free slot
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("OMADA_MAX_CONCURRENT_REQUESTS", str(POOL_SIZE)))
+
+def _verify_setting():
+    """OMADA_VERIFY_SSL: true, false (default) or a path to a CA bundle"""
+    value = os.environ.get("OMADA_VERIFY_SSL", "false").strip()
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("", "0", "false", "no"):
+        return False
+    return value
+
+VERIFY_SSL = _verify_setting()
+
+def _endpoint_class(method: str, url: str) -> str:
+    """Pick the timeout class for a request"""
+    if '/openapi/authorize/' in url:
+        return 'auth'
+    return 'read' if method.upper() == 'GET' else 'write'
+
+# Read circuit breaker: consecutive failures (or slow calls) before opening,
+# the latency that counts as a failure, and how long to fail fast once open
+BREAKER_FAILURES = int(os.environ.get("OMADA_BREAKER_FAILURES", "5"))
+BREAKER_SLOW_CALL = float(os.environ.get("OMADA_BREAKER_SLOW_CALL", "8"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("OMADA_BREAKER_RESET_TIMEOUT", "30"))
+
+# Response cache for voucher group reads: seconds to keep a list page or a
+# group detail page (0 disables)
+CACHE_TTL_GROUP_LIST = float(os.environ.get("OMADA_CACHE_TTL_GROUP_LIST", "30"))
+CACHE_TTL_GROUP_DETAIL = float(os.environ.get("OMADA_CACHE_TTL_GROUP_DETAIL", "15"))
+
+# How long last-good snapshots (served while the controller is down) are kept
+SNAPSHOT_TTL = float(os.environ.get("OMADA_SNAPSHOT_TTL", "86400"))
+
+class JitteredRetry(Retry):
+    """Exponential backoff with full jitter, so workers don't retry in lockstep"""
+    
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
+def build_session() -> requests.Session:
+    """Create a pooled keep-alive session that retries idempotent GETs"""
+    session = requests.Session()
+    session.verify = VERIFY_SSL
+    
+    retry = JitteredRetry(
+        total=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class OmadaAPIError(Exception):
+    """Raised when the controller cannot return a page we need"""
+    pass
+
+class CircuitOpenError(OmadaAPIError):
+    """Raised instead of calling the controller while the read breaker is open"""
+    pass
+
+# Not an OmadaAPIError: readers that turn those into None must let this through
+class DeadlineExceeded(Exception):
+    """Raised instead of starting a controller read after the caller's deadline"""
+    pass
+
+def check_deadline(deadline: Optional[float]):
+    """Raise DeadlineExceeded once time.monotonic() is past deadline (None: no deadline)"""
+    if deadline is not None and time.monotonic() > deadline:
+        raise DeadlineExceeded("Deadline passed before the next Omada Controller read")
+
+class CircuitBreaker:
+    """Stop sending reads to a controller that keeps failing or answering slowly
+
+    Closed: every call goes through. After ``failure_threshold`` consecutive
+    failures (errors, 5xx or calls slower than ``slow_call``) it opens and
+    callers fail fast. After ``reset_timeout`` one trial call is let through
+    (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, slow_call: float = BREAKER_SLOW_CALL,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = max(1, failure_threshold)
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Close the breaker and forget past failures"""
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != 'closed'
+
+    def allow(self) -> bool:
+        """Check whether a read may be sent now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, elapsed: float, ok: bool):
+        """Record the outcome of a call that allow() let through"""
+        with self._lock:
+            self._trial_in_flight = False
+            if ok and elapsed < self.slow_call:
+                if self.state != 'closed':
+                    logging.info("Omada circuit breaker closed")
+                self.state = 'closed'
+                self.failures = 0
+                return
+            
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state == 'closed':
+                    logging.warning(f"Omada circuit breaker open after {self.failures} failed or slow reads")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+# Shared by all OmadaAPI instances in this process
+read_breaker = CircuitBreaker()
+
+class SingleFlight:
+    """Let concurrent identical calls share one execution
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for its result (or exception) instead of running it
+    again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func: Callable):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        
+        if not leader:
+            logging.debug(f"Coalesced duplicate controller request: {key[:2]}")
+            return future.result()
+        
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+# Shared by all OmadaAPI instances in this process
+inflight_reads = SingleFlight()
+
+# Shared by all OmadaAPI instances in this process
+request_slots = threading.BoundedSemaphore(max(1, MAX_CONCURRENT_REQUESTS))
+
+# Shared by all OmadaAPI instances in this process; the backend may also
+# share it with other workers (OMADA_CACHE_BACKEND)
+response_cache = create_cache_backend()
+
+# Last-good snapshots, in a store of their own so response churn can't evict them
+snapshot_cache = create_cache_backend('snapshots')
+
+def _with_app_context(func: Callable) -> Callable:
+    """Wrap func so it runs inside the caller's app context on another thread"""
+    if not has_app_context():
+        return func
+    app = current_app._get_current_object()
+    
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+    return wrapper
+
+def _cached_read(ttl: float):
+    """Serve a voucher group read from the response cache while it is fresh"""
+    def decorator(func):
+        signature = inspect.signature(func)
+        
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            params.pop('self')
+            params.update(params.pop('filters', {}))
+            key = self._cache_key(params.pop('site_id'), params.get('group_id'), func.__name__, params)
+            return self._cached_get(key, ttl, lambda: func(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+class OmadaAPI:
+    base_url = _shared_field('base_url')
+    client_id = _shared_field('client_id')
+    client_secret = _shared_field('client_secret')
+    omadac_id = _shared_field('omadac_id')
+    access_token = _shared_field('access_token')
+    refresh_token = _shared_field('refresh_token')
+    token_expires_at = _shared_field('token_expires_at')
+
+    def __init__(self):
+        self._tokens = token_cache
+        self.breaker = read_breaker
+        self.cache = response_cache
+        self.snapshots = snapshot_cache
+        self.inflight = inflight_reads
+        self.slots = request_slots
+        self.session = build_session()
+    
+    def _http(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request through the pooled session with per-endpoint timeouts
+        
+        Reads go through the circuit breaker and raise CircuitOpenError
+        without touching the network while it is open. Identical reads
+        already in flight on another thread are shared, not repeated. At
+        most MAX_CONCURRENT_REQUESTS requests are sent at once.
+        """
+        endpoint_class = _endpoint_class(method, url)
+        kwargs.setdefault('timeout', TIMEOUTS[endpoint_class])
+        if endpoint_class != 'read':
+            with self.slots:
+                return self.session.request(method, url, **kwargs)
+        
+        key = (method.upper(), url, tuple(sorted((kwargs.get('params') or {}).items())))
+        return self.inflight.do(key, lambda: self._read(method, url, **kwargs))
+    
+    def _read(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a read through the circuit breaker"""
+        if not self.breaker.allow():
+            raise CircuitOpenError("Omada Controller unavailable, circuit breaker open")
+        
+        with self.slots:
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+                response.content  # read the body now so waiting callers can share it
+            except Exception:
+                self.breaker.record(time.monotonic() - started, ok=False)
+                raise
+        self.breaker.record(time.monotonic() - started, ok=response.status_code < 500)
+        return response
         
     def _get_config(self) -> Optional[OmadaConfig]:
         """Get Omada configuration from database"""
@@ -43,14 +390,17 @@ class OmadaAPI:
         
         db.session.commit()
         
-        # Update instance variables
+        # Update the shared in-memory tokens
         self.access_token = config.access_token
         self.refresh_token = config.refresh_token
         self.token_expires_at = config.token_expires_at
+        self._tokens.config_version = (config.id, config.updated_at)
+        self._tokens.loaded = True
+        self._publish_token()
     
-    def _load_tokens(self):
-        """Load tokens from database"""
-        config = self._get_config()
+    def _load_tokens(self, config=None):
+        """Load tokens from database (or from an already read config row)"""
+        config = config or self._get_config()
         if config:
             self.access_token = config.access_token
             self.refresh_token = config.refresh_token
@@ -59,6 +409,93 @@ class OmadaAPI:
             self.client_id = config.client_id
             self.client_secret = config.client_secret
             self.omadac_id = config.omadac_id
+            self._tokens.config_version = (config.id, config.updated_at)
+        self._tokens.config_checked_at = time.monotonic()
+        self._tokens.loaded = True
+    
+    def _token_key(self) -> tuple:
+        return (self._controller_key(), None, None, 'token', ())
+    
+    def _publish_token(self):
+        """Share the current token with the other workers through the cache backend"""
+        if not self.token_expires_at:
+            return
+        ttl = (self.token_expires_at - datetime.utcnow()).total_seconds()
+        self.cache.set(self._token_key(), {
+            'access_token': self.access_token,
+            'refresh_token': self.refresh_token,
+            'token_expires_at': self.token_expires_at
+        }, ttl)
+    
+    def _adopt_shared_token(self) -> bool:
+        """Use a token another worker obtained, if it differs from ours and is still valid"""
+        shared = self.cache.get(self._token_key())
+        if not shared or shared['access_token'] == self.access_token:
+            return False
+        self.access_token = shared['access_token']
+        self.refresh_token = shared['refresh_token']
+        self.token_expires_at = shared['token_expires_at']
+        return self._tokens.is_valid()
+    
+    def _check_config_version(self):
+        """Reload the config and tokens if the active config row changed since we loaded it"""
+        self._tokens.config_checked_at = time.monotonic()
+        # On its own connection, so a caller's open transaction can't show a stale row
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                db.select(OmadaConfig.__table__).filter_by(is_active=True).limit(1)
+            ).first()
+        if (row and (row.id, row.updated_at)) == self._tokens.config_version:
+            return
+        
+        with self._tokens.refresh_lock:
+            logging.info("Omada Controller configuration changed, reloading it")
+            if row:
+                # Overwrite in place: other threads never see the defaults
+                self._load_tokens(row)
+            else:
+                self._tokens.reset()
+        # Failures counted against the old controller say nothing about the new one
+        self.breaker.reset()
+    
+    def reset_token_cache(self):
+        """Drop the in-memory tokens, e.g. after the controller config changed"""
+        with self._tokens.refresh_lock:
+            self._tokens.reset()
+    
+    def _controller_key(self) -> str:
+        """Identify the configured controller, loading the config on first use"""
+        if not self._tokens.loaded:
+            with self._tokens.refresh_lock:
+                if not self._tokens.loaded:
+                    self._load_tokens()
+        return f"{self.base_url}|{self.omadac_id}"
+    
+    def _cache_key(self, site_id: str, group_id: Optional[str], endpoint: str, params: Dict) -> tuple:
+        return (self._controller_key(), site_id, group_id, endpoint, tuple(sorted(params.items())))
+    
+    def _cached_get(self, key: tuple, ttl: float, fetch: Callable[[], Optional[Dict]]) -> Optional[Dict]:
+        """Serve a read from the response cache, storing it on a successful fetch"""
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        
+        result = fetch()
+        if result and result.get('errorCode') == 0:
+            self.cache.set(key, result, ttl)
+        return result
+    
+    def invalidate_cache(self, site_id: str, group_ids: Optional[List[str]] = None):
+        """Forget cached reads for a site, or for its group list and the given groups"""
+        self.cache.invalidate(self._controller_key(), site_id, group_ids)
+    
+    def load_snapshot(self, name: str, params: Dict):
+        """Get the last good result stored with store_snapshot, or None"""
+        return self.snapshots.get(self._cache_key(None, None, name, params))
+    
+    def store_snapshot(self, name: str, params: Dict, value, ttl: float = SNAPSHOT_TTL):
+        """Keep a last good result, shared with the other workers, for use while the controller is down"""
+        self.snapshots.set(self._cache_key(None, None, name, params), value, ttl)
     
     def _is_token_expired(self) -> bool:
         """Check if current token is expired"""
@@ -91,7 +528,7 @@ class OmadaAPI:
             logging.info(f"Using client_id: {self.client_id}")
             logging.info(f"Client secret configured: {'Yes' if self.client_secret else 'No'}")
             
-            response = self.session.post(url, json=data, headers=headers)
+            response = self._http('POST', url, json=data, headers=headers)
             response.raise_for_status()
             
             result = response.json()
@@ -131,7 +568,7 @@ class OmadaAPI:
                 "client_secret": self.client_secret
             }
             
-            response = self.session.post(url, params=params, json=data)
+            response = self._http('POST', url, params=params, json=data)
             response.raise_for_status()
             
             result = response.json()
@@ -153,18 +590,32 @@ class OmadaAPI:
     
     def _ensure_valid_token(self) -> bool:
         """Ensure we have a valid access token"""
-        self._load_tokens()
+        if self._tokens.config_check_due():
+            self._check_config_version()
         
-        if not self.access_token or self._is_token_expired():
-            if self.refresh_token:
-                token = self.refresh_access_token()
-            else:
-                token = self.get_access_token()
-            
-            if not token:
-                return False
+        # Fast path: token still valid in memory, no database access
+        if self._tokens.is_valid():
+            return True
         
-        return True
+        # Only one thread refreshes; the others wait here and reuse its token
+        with self._tokens.refresh_lock:
+            if not self._tokens.loaded:
+                self._load_tokens()
+            
+            if self._tokens.is_valid():
+                return True
+            
+            # Only one worker refreshes; the others pick its token up from the cache backend
+            with self.cache.lock('token'):
+                if self._adopt_shared_token():
+                    return True
+                
+                if self.refresh_token:
+                    token = self.refresh_access_token()
+                else:
+                    token = self.get_access_token()
+                
+                return bool(token)
     
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Dict]:
         """Make authenticated request to Omada API"""
@@ -178,13 +629,15 @@ class OmadaAPI:
         }
         
         try:
-            response = self.session.request(method, url, headers=headers, **kwargs)
+            response = self._http(method, url, headers=headers, **kwargs)
             response.raise_for_status()
             
             result = response.json()
             if result.get('errorCode') == 0:
                 return result.get('result')
             else:
+                if result.get('errorCode') in TOKEN_ERROR_CODES:
+                    self._tokens.token_expires_at = None
                 logging.error(f"API Error: {result.get('msg')}")
                 return None
                 
@@ -192,6 +645,163 @@ class OmadaAPI:
             logging.error(f"Request error: {str(e)}")
             return None
     
+    @staticmethod
+    def _page_rows(response) -> tuple:
+        """Normalize a paged response into (rows, total_rows)"""
+        if isinstance(response, list):
+            # get_sites already unwraps the result
+            return response, None
+        if not response or response.get('errorCode') != 0:
+            msg = response.get('msg') if response else 'no response'
+            raise OmadaAPIError(f"Paged request failed: {msg}")
+        result = response.get('result') or {}
+        return result.get('data') or [], result.get('totalRows')
+    
+    def iter_pages(self, fetch: Callable, *args, page_size: int = MAX_PAGE_SIZE, **kwargs) -> Iterator[List[Dict]]:
+        """Yield every page of a paged endpoint as a list of rows
+        
+        Works with get_sites, get_voucher_groups, get_voucher_group_list and
+        get_individual_vouchers_from_group. Page N+1 is fetched in the
+        background while the caller processes page N.
+        """
+        fetch_page = _with_app_context(fetch)
+        executor = ThreadPoolExecutor(max_workers=1)
+        
+        try:
+            page = 1
+            rows, total_rows = self._page_rows(fetch_page(*args, page=page, page_size=page_size, **kwargs))
+            fetched = 0
+            
+            while rows:
+                fetched += len(rows)
+                if total_rows is not None:
+                    has_more = fetched < total_rows
+                else:
+                    has_more = len(rows) >= page_size
+                
+                next_page = None
+                if has_more:
+                    next_page = executor.submit(fetch_page, *args, page=page + 1, page_size=page_size, **kwargs)
+                
+                yield rows
+                
+                if not next_page:
+                    break
+                page += 1
+                rows, total_rows = self._page_rows(next_page.result())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def iter_items(self, fetch: Callable, *args, page_size: int = MAX_PAGE_SIZE, **kwargs) -> Iterator[Dict]:
+        """Yield every row of a paged endpoint, one page in memory at a time"""
+        for rows in self.iter_pages(fetch, *args, page_size=page_size, **kwargs):
+            yield from rows
+    
+    def iter_concurrent(self, func: Callable, items, max_workers: Optional[int] = None) -> Iterator[tuple]:
+        """Call func(item) for every item on a bounded thread pool
+        
+        Yields (item, result) pairs on the calling thread as each call
+        completes, so the caller can apply DB writes as results arrive.
+        Items are consumed lazily, keeping at most 2 * max_workers in flight.
+        """
+        max_workers = max(1, max_workers or SYNC_CONCURRENCY)
+        run = _with_app_context(func)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = {}
+        
+        def drain(return_when):
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                yield pending.pop(future), future.result()
+        
+        try:
+            for item in items:
+                pending[executor.submit(run, item)] = item
+                if len(pending) >= max_workers * 2:
+                    yield from drain(FIRST_COMPLETED)
+            while pending:
+                yield from drain(FIRST_COMPLETED)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _iter_group_pages(self, site_id: str, group_id: str, status_filter: Optional[int] = None,
+                          max_workers: int = GROUP_PAGE_WORKERS, deadline: Optional[float] = None) -> Iterator[Dict]:
+        """Yield every page response of a voucher group detail, in page order
+        
+        The first page tells us how many pages exist; the rest are fetched
+        concurrently, with at most max_workers requests in flight. Without
+        a total, pages are read one by one until a short page. No page read
+        starts after deadline (see check_deadline).
+        """
+        fetch_page = _with_app_context(self.get_individual_vouchers_from_group)
+        
+        check_deadline(deadline)
+        first = fetch_page(site_id, group_id, page=1, page_size=MAX_PAGE_SIZE, status_filter=status_filter)
+        rows, total_rows = self._page_rows(first)
+        
+        if not total_rows:
+            # totalRows missing (or 0 next to rows): a full page means there may be more
+            yield first
+            page = 1
+            while len(rows) >= MAX_PAGE_SIZE:
+                page += 1
+                check_deadline(deadline)
+                response = fetch_page(site_id, group_id, page=page, page_size=MAX_PAGE_SIZE, status_filter=status_filter)
+                rows, _ = self._page_rows(response)
+                yield response
+            return
+        
+        total_pages = math.ceil(total_rows / MAX_PAGE_SIZE)
+        if total_pages <= 1:
+            yield first
+            return
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            pending = deque()
+            next_page = 2
+            
+            def fill_window():
+                nonlocal next_page
+                while next_page <= total_pages and len(pending) < max_workers:
+                    check_deadline(deadline)
+                    pending.append(executor.submit(fetch_page, site_id, group_id, page=next_page,
+                                                   page_size=MAX_PAGE_SIZE, status_filter=status_filter))
+                    next_page += 1
+            
+            fill_window()
+            yield first
+            
+            while pending:
+                response = pending.popleft().result()
+                self._page_rows(response)  # raises if the page failed
+                fill_window()
+                yield response
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def iter_group_vouchers(self, site_id: str, group_id: str, status_filter: Optional[int] = None,
+                            max_workers: int = GROUP_PAGE_WORKERS) -> Iterator[Dict]:
+        """Yield every voucher of a group, including groups larger than one page"""
+        for response in self._iter_group_pages(site_id, group_id, status_filter, max_workers):
+            yield from response.get('result', {}).get('data') or []
+    
+    def get_full_voucher_group_detail(self, site_id: str, group_id: str, status_filter: Optional[int] = None,
+                                      deadline: Optional[float] = None) -> Optional[Dict]:
+        """Same as get_voucher_group_detail, but result['data'] holds every voucher in the group"""
+        try:
+            detail = None
+            for response in self._iter_group_pages(site_id, group_id, status_filter, deadline=deadline):
+                if detail is None:
+                    detail = dict(response, result=dict(response['result']))
+                    detail['result']['data'] = list(detail['result'].get('data') or [])
+                else:
+                    detail['result']['data'].extend(response['result'].get('data') or [])
+            return detail
+        except OmadaAPIError as e:
+            logging.error(f"Error getting full voucher group detail for {group_id}: {str(e)}")
+            return None
+    
     def get_sites(self, page: int = 1, page_size: int = 100, search_key: str = None, site_type: int = None) -> Optional[List[Dict]]:
         """Get list of sites from Omada Controller"""
         params = {
@@ -234,7 +844,7 @@ class OmadaAPI:
             logging.debug(f"Request headers: {headers}")
             logging.debug(f"Request payload: {voucher_data}")
             
-            response = self.session.post(url, headers=headers, json=voucher_data)
+            response = self._http('POST', url, headers=headers, json=voucher_data)
             
             logging.debug(f"Response status code: {response.status_code}")
             logging.debug(f"Response headers: {response.headers}")
@@ -267,6 +877,8 @@ class OmadaAPI:
             logging.error(f"Error creating voucher group: {str(e)}")
             logging.error(f"Exception type: {type(e)}")
             return None
+        finally:
+            self.invalidate_cache(site_id, [])
     
     def get_voucher_summary(self, site_id: str, start_date: str = None, end_date: str = None) -> Optional[Dict]:
         """Get voucher summary from Omada Controller"""
@@ -279,6 +891,7 @@ class OmadaAPI:
             
         return self._make_request('GET', endpoint, params=params)
     
+    @_cached_read(CACHE_TTL_GROUP_LIST)
     def get_voucher_groups(self, site_id: str, page: int = 1, page_size: int = 100, **filters) -> Optional[Dict]:
         """Get voucher group list from Omada Controller"""
         if not self._ensure_valid_token():
@@ -306,7 +919,7 @@ class OmadaAPI:
         }
         
         try:
-            response = self.session.get(url, headers=headers, params=params)
+            response = self._http('GET', url, headers=headers, params=params)
             response.raise_for_status()
             result = response.json()
             logging.info(f"Voucher groups retrieved: {result.get('result', {}).get('totalRows', 0)} total")
@@ -315,6 +928,7 @@ class OmadaAPI:
             logging.error(f"Error getting voucher groups: {str(e)}")
             return None
 
+    @_cached_read(CACHE_TTL_GROUP_DETAIL)
     def get_voucher_group_detail(self, site_id: str, group_id: str, page: int = 1, page_size: int = 1000) -> Optional[Dict]:
         """Get detailed information about a specific voucher group including individual voucher statuses"""
         if not self._ensure_valid_token():
@@ -334,7 +948,7 @@ class OmadaAPI:
         }
         
         try:
-            response = self.session.get(url, headers=headers, params=params)
+            response = self._http('GET', url, headers=headers, params=params)
             response.raise_for_status()
             result = response.json()
             logging.info(f"Retrieved voucher group detail for {group_id}: {result.get('result', {}).get('totalCount', 0)} vouchers")
@@ -363,7 +977,7 @@ class OmadaAPI:
         }
         
         try:
-            response = self.session.get(url, headers=headers, params=params)
+            response = self._http('GET', url, headers=headers, params=params)
             response.raise_for_status()
             result = response.json()
             logging.info(f"Retrieved vouchers from group {voucher_group_id}: {result.get('result', {}).get('totalRows', 0)} vouchers")
@@ -396,7 +1010,7 @@ class OmadaAPI:
         
         try:
             logging.debug(f"Making DELETE request to: {url}")
-            response = self.session.delete(url, headers=headers)
+            response = self._http('DELETE', url, headers=headers)
             
             logging.debug(f"Response status code: {response.status_code}")
             logging.debug(f"Response text: {response.text}")
@@ -427,6 +1041,8 @@ class OmadaAPI:
         except Exception as e:
             logging.error(f"Error deleting expired vouchers: {str(e)}")
             return None
+        finally:
+            self.invalidate_cache(site_id, [group_id])
     
     def delete_voucher(self, site_id: str, voucher_id: str) -> Optional[Dict]:
         """Delete a specific voucher"""
@@ -446,7 +1062,7 @@ class OmadaAPI:
         
         try:
             logging.debug(f"Making DELETE request to: {url}")
-            response = self.session.delete(url, headers=headers)
+            response = self._http('DELETE', url, headers=headers)
             
             logging.debug(f"Response status code: {response.status_code}")
             logging.debug(f"Response text: {response.text}")
@@ -466,7 +1082,10 @@ class OmadaAPI:
         except Exception as e:
             logging.error(f"Error deleting voucher: {str(e)}")
             return None
+        finally:
+            self.invalidate_cache(site_id)
     
+    @_cached_read(CACHE_TTL_GROUP_LIST)
     def get_voucher_group_list(self, site_id: str, page: int = 1, page_size: int = 100, **filters) -> Optional[Dict]:
         """Get voucher group list from Omada Controller"""
         endpoint = f"sites/{site_id}/hotspot/voucher-groups"
@@ -498,7 +1117,7 @@ class OmadaAPI:
         
         try:
             logging.debug(f"Making GET request to: {url}")
-            response = self.session.get(url, headers=headers, params=params)
+            response = self._http('GET', url, headers=headers, params=params)
             
             logging.debug(f"Response status code: {response.status_code}")
             logging.debug(f"Response text: {response.text}")
@@ -519,8 +1138,11 @@ class OmadaAPI:
             logging.error(f"Error getting voucher group list: {str(e)}")
             return None
 
-    def get_individual_vouchers_from_group(self, site_id: str, group_id: str, page: int = 1, page_size: int = 1000, status_filter: Optional[int] = None) -> Optional[Dict]:
-        """Get individual vouchers from a voucher group"""
+    # Not cached: the sync reads every page of the groups that changed and
+    # needs them fresh, and they would only push list reads out of the cache
+    def get_individual_vouchers_from_group(self, site_id: str, group_id: str, page: int = 1, page_size: int = 1000, status_filter: Optional[int] = None,
+                                           search_key: Optional[str] = None) -> Optional[Dict]:
+        """Get individual vouchers from a voucher group, optionally only those whose code matches search_key"""
         endpoint = f"sites/{site_id}/hotspot/voucher-groups/{group_id}"
         
         params = {
@@ -531,6 +1153,8 @@ class OmadaAPI:
         # Add status filter if provided (0: unused, 1: in-use, 2: expired)
         if status_filter is not None:
             params['filters.status'] = status_filter
+        if search_key:
+            params['searchKey'] = search_key
         
         logging.info(f"Getting individual vouchers from group {group_id} for site {site_id}")
         
@@ -546,7 +1170,7 @@ class OmadaAPI:
         
         try:
             logging.debug(f"Making GET request to: {url}")
-            response = self.session.get(url, headers=headers, params=params)
+            response = self._http('GET', url, headers=headers, params=params)
             
             logging.debug(f"Response status code: {response.status_code}")
             logging.debug(f"Response text: {response.text}")
@@ -599,7 +1223,7 @@ class OmadaAPI:
             logging.debug(f"Making POST request to: {url}")
             logging.debug(f"Request payload: {payload}")
             
-            response = self.session.post(url, headers=headers, json=payload)
+            response = self._http('POST', url, headers=headers, json=payload)
             
             logging.debug(f"Response status code: {response.status_code}")
             logging.debug(f"Response text: {response.text}")
@@ -619,6 +1243,8 @@ class OmadaAPI:
         except Exception as e:
             logging.error(f"Error batch deleting vouchers: {str(e)}")
             return None
+        finally:
+            self.invalidate_cache(site_id, [group_id])
 
     def delete_voucher_groups(self, site_id: str, group_ids: List[str], delete_type: int = 1) -> Optional[Dict]:
         """Delete selected voucher groups
@@ -653,7 +1279,7 @@ class OmadaAPI:
             logging.debug(f"Making POST request to: {url}")
             logging.debug(f"Request payload: {data}")
             
-            response = self.session.post(url, headers=headers, json=data)
+            response = self._http('POST', url, headers=headers, json=data)
             
             logging.debug(f"Response status code: {response.status_code}")
             logging.debug(f"Response text: {response.text}")
@@ -673,6 +1299,8 @@ class OmadaAPI:
         except Exception as e:
             logging.error(f"Error deleting voucher groups: {str(e)}")
             return None
+        finally:
+            self.invalidate_cache(site_id, group_ids if delete_type == 1 else None)
 
 # Global instance
 omada_api = OmadaAPI()
@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from omada_api import (MAX_PAGE_SIZE, MAX_RETRIES, RETRY_BACKOFF, RETRY_STATUSES, TIMEOUTS, TOKEN_ERROR_CODES,
+                       VERIFY_SSL, CircuitOpenError, OmadaAPI, _endpoint_class, _with_app_context, read_breaker,
+                       token_cache)
+
+# Keep-alive connections shared by all concurrent calls of one client
+ASYNC_MAX_CONNECTIONS = 20
+
+# Known controller error codes, logged next to the raw error message
+ERROR_MESSAGES = {
+    -33000: "Site does not exist",
+    -33004: "Operation failed due to concurrent operations",
+    -42010: "Voucher limit reached",
+    -42036: "Portal selection error",
+    -42059: "Duplicated voucher group name",
+    -44111: "Invalid Grant Type",
+    -44112: "Access token has expired",
+}
+
+class AsyncOmadaAPI:
+    """asyncio version of OmadaAPI
+    
+    Mirrors the OmadaAPI methods as coroutines on top of one pooled
+    httpx.AsyncClient, so many controller calls can run concurrently on a
+    single thread with asyncio.gather. Tokens come from the same in-memory
+    TokenCache as OmadaAPI; refreshes reuse the sync client in a worker
+    thread so they stay single-flight across both clients.
+    
+    Usage:
+        async with AsyncOmadaAPI() as api:
+            details = await asyncio.gather(*(api.get_voucher_group_detail(site_id, gid) for gid in group_ids))
+    """
+    
+    def __init__(self, max_connections: int = ASYNC_MAX_CONNECTIONS):
+        self._sync = OmadaAPI()
+        self._tokens = token_cache
+        self.client = httpx.AsyncClient(
+            verify=VERIFY_SSL,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def close(self):
+        """Close the pooled connections"""
+        await self.client.aclose()
+    
+    async def get_access_token(self) -> Optional[str]:
+        """Get access token using client credentials"""
+        return await asyncio.to_thread(_with_app_context(self._sync.get_access_token))
+    
+    async def refresh_access_token(self) -> Optional[str]:
+        """Refresh access token using refresh token"""
+        return await asyncio.to_thread(_with_app_context(self._sync.refresh_access_token))
+    
+    async def _ensure_valid_token(self) -> bool:
+        """Ensure we have a valid access token"""
+        if self._tokens.is_valid() and not self._tokens.config_check_due():
+            return True
+        return await asyncio.to_thread(_with_app_context(self._sync._ensure_valid_token))
+    
+    def _url(self, endpoint: str) -> str:
+        return f"{self._tokens.base_url}/openapi/v1/{self._tokens.omadac_id}/{endpoint}"
+    
+    def _headers(self, content_type: str = 'application/json') -> Dict:
+        return {
+            'Authorization': f'AccessToken={self._tokens.access_token}',
+            'Content-Type': content_type
+        }
+    
+    async def _request(self, method: str, endpoint: str, action: str,
+                       content_type: str = 'application/json', **kwargs) -> Optional[Dict]:
+        """Make authenticated request and return the full response body"""
+        if not await self._ensure_valid_token():
+            logging.error(f"Failed to obtain valid token for {action}")
+            return None
+        
+        try:
+            response = await self._send(method, self._url(endpoint), headers=self._headers(content_type), **kwargs)
+            response.raise_for_status()
+            result = response.json()
+            
+            error_code = result.get('errorCode')
+            if error_code != 0:
+                logging.error(f"Omada API returned error {error_code}: {result.get('msg', 'Unknown error')}")
+                if error_code in ERROR_MESSAGES:
+                    logging.error(ERROR_MESSAGES[error_code])
+                if error_code in TOKEN_ERROR_CODES:
+                    self._tokens.token_expires_at = None
+            
+            return result
+        except Exception as e:
+            logging.error(f"Error {action}: {str(e)}")
+            return None
+    
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send with per-endpoint timeouts, retrying GETs with jittered backoff
+        
+        Reads share the sync client's circuit breaker.
+        """
+        endpoint_class = _endpoint_class(method, url)
+        connect, read = TIMEOUTS[endpoint_class]
+        kwargs.setdefault('timeout', httpx.Timeout(read, connect=connect))
+        if endpoint_class != 'read':
+            return await self._send_with_retries(method, url, 0, **kwargs)
+        
+        if not read_breaker.allow():
+            raise CircuitOpenError("Omada Controller unavailable, circuit breaker open")
+        
+        started = time.monotonic()
+        try:
+            response = await self._send_with_retries(method, url, MAX_RETRIES, **kwargs)
+        except Exception:
+            read_breaker.record(time.monotonic() - started, ok=False)
+            raise
+        read_breaker.record(time.monotonic() - started, ok=response.status_code < 500)
+        return response
+    
+    async def _send_with_retries(self, method: str, url: str, retries: int, **kwargs) -> httpx.Response:
+        for attempt in range(retries + 1):
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    return response
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+            await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * (2 ** attempt)))
+    
+    async def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Dict]:
+        """Make authenticated request and return only the result payload"""
+        result = await self._request(method, endpoint, f"requesting {endpoint}", **kwargs)
+        if result and result.get('errorCode') == 0:
+            return result.get('result')
+        return None
+    
+    @staticmethod
+    def _group_list_params(page: int, page_size: int, filters: Dict) -> Dict:
+        params = {
+            'page': page,
+            'pageSize': page_size
+        }
+        if filters.get('time_start'):
+            params['filters.timeStart'] = filters['time_start']
+        if filters.get('time_end'):
+            params['filters.timeEnd'] = filters['time_end']
+        if filters.get('search_key'):
+            params['searchKey'] = filters['search_key']
+        return params
+    
+    async def get_sites(self, page: int = 1, page_size: int = 100, search_key: str = None, site_type: int = None) -> Optional[List[Dict]]:
+        """Get list of sites from Omada Controller"""
+        params = {
+            "page": page,
+            "pageSize": min(page_size, MAX_PAGE_SIZE)
+        }
+        if search_key:
+            params["searchKey"] = search_key
+        if site_type is not None:
+            params["filters.type"] = str(site_type)
+        
+        result = await self._make_request('GET', 'sites', params=params)
+        if result:
+            return result.get('data', [])
+        return None
+    
+    async def create_voucher_group(self, site_id: str, voucher_data: Dict) -> Optional[Dict]:
+        """Create voucher group in Omada Controller"""
+        logging.info(f"Creating voucher group for site {site_id} with data: {voucher_data}")
+        try:
+            return await self._request('POST', f"sites/{site_id}/hotspot/voucher-groups",
+                                       "creating voucher group", json=voucher_data)
+        finally:
+            self._sync.invalidate_cache(site_id, [])
+    
+    async def get_voucher_summary(self, site_id: str, start_date: str = None, end_date: str = None) -> Optional[Dict]:
+        """Get voucher summary from Omada Controller"""
+        params = {}
+        if start_date:
+            params['startDate'] = start_date
+        if end_date:
+            params['endDate'] = end_date
+        return await self._make_request('GET', f"sites/{site_id}/hotspot/vouchers/summary", params=params)
+    
+    async def get_voucher_groups(self, site_id: str, page: int = 1, page_size: int = 100, **filters) -> Optional[Dict]:
+        """Get voucher group list from Omada Controller"""
+        return await self._request('GET', f"sites/{site_id}/hotspot/voucher-groups", "getting voucher groups",
+                                   params=self._group_list_params(page, page_size, filters))
+    
+    async def get_voucher_group_detail(self, site_id: str, group_id: str, page: int = 1, page_size: int = 1000) -> Optional[Dict]:
+        """Get detailed information about a specific voucher group including individual voucher statuses"""
+        return await self._request('GET', f"sites/{site_id}/hotspot/voucher-groups/{group_id}",
+                                   f"getting voucher group detail for {group_id}",
+                                   params={'page': page, 'pageSize': page_size})
+    
+    async def get_vouchers_from_group(self, site_id: str, voucher_group_id: str, page: int = 1, page_size: int = 100) -> Optional[Dict]:
+        """Get voucher codes from a specific voucher group"""
+        params = {
+            'page': page,
+            'pageSize': page_size,
+            'filters.voucherGroupId': voucher_group_id
+        }
+        return await self._request('GET', f"sites/{site_id}/hotspot/vouchers",
+                                   f"getting vouchers from group {voucher_group_id}", params=params)
+    
+    async def export_vouchers(self, site_id: str, **filters) -> Optional[Dict]:
+        """Export vouchers from Omada Controller"""
+        return await self._make_request('GET', f"sites/{site_id}/hotspot/vouchers/export", params=filters)
+    
+    async def delete_expired_vouchers(self, site_id: str, group_id: str) -> Optional[Dict]:
+        """Delete expired vouchers in a voucher group"""
+        logging.info(f"Deleting expired vouchers for site {site_id}, group {group_id}")
+        try:
+            return await self._request('DELETE', f"sites/{site_id}/hotspot/voucher-groups/{group_id}/clear-invalid",
+                                       "deleting expired vouchers", content_type='application/x-www-form-urlencoded')
+        finally:
+            self._sync.invalidate_cache(site_id, [group_id])
+    
+    async def delete_voucher(self, site_id: str, voucher_id: str) -> Optional[Dict]:
+        """Delete a specific voucher"""
+        logging.info(f"Deleting voucher {voucher_id} for site {site_id}")
+        try:
+            return await self._request('DELETE', f"sites/{site_id}/hotspot/vouchers/{voucher_id}",
+                                       "deleting voucher", content_type='application/x-www-form-urlencoded')
+        finally:
+            self._sync.invalidate_cache(site_id)
+    
+    async def get_voucher_group_list(self, site_id: str, page: int = 1, page_size: int = 100, **filters) -> Optional[Dict]:
+        """Get voucher group list from Omada Controller"""
+        return await self._request('GET', f"sites/{site_id}/hotspot/voucher-groups", "getting voucher group list",
+                                   content_type='application/x-www-form-urlencoded',
+                                   params=self._group_list_params(page, page_size, filters))
+    
+    async def get_individual_vouchers_from_group(self, site_id: str, group_id: str, page: int = 1, page_size: int = 1000, status_filter: Optional[int] = None,
+                                                 search_key: Optional[str] = None) -> Optional[Dict]:
+        """Get individual vouchers from a voucher group, optionally only those whose code matches search_key"""
+        params = {
+            'page': page,
+            'pageSize': page_size
+        }
+        if status_filter is not None:
+            params['filters.status'] = status_filter
+        if search_key:
+            params['searchKey'] = search_key
+        return await self._request('GET', f"sites/{site_id}/hotspot/voucher-groups/{group_id}",
+                                   "getting voucher group detail", content_type='application/x-www-form-urlencoded',
+                                   params=params)
+    
+    async def get_full_voucher_group_detail(self, site_id: str, group_id: str, status_filter: Optional[int] = None) -> Optional[Dict]:
+        """Same as get_voucher_group_detail, but result['data'] holds every voucher in the group"""
+        first = await self.get_individual_vouchers_from_group(site_id, group_id, page=1, page_size=MAX_PAGE_SIZE,
+                                                              status_filter=status_filter)
+        if not first or first.get('errorCode') != 0:
+            return None
+        
+        result = first.get('result') or {}
+        data = list(result.get('data') or [])
+        
+        def page_rows(page: Optional[Dict]) -> Optional[List[Dict]]:
+            if not page or page.get('errorCode') != 0:
+                logging.error(f"Error getting full voucher group detail for {group_id}")
+                return None
+            return page.get('result', {}).get('data') or []
+        
+        if not result.get('totalRows'):
+            # totalRows missing (or 0 next to rows): a full page means there may be more
+            rows, page = data, 1
+            while len(rows) >= MAX_PAGE_SIZE:
+                page += 1
+                rows = page_rows(await self.get_individual_vouchers_from_group(
+                    site_id, group_id, page=page, page_size=MAX_PAGE_SIZE, status_filter=status_filter))
+                if rows is None:
+                    return None
+                data.extend(rows)
+            return dict(first, result=dict(result, data=data))
+        
+        total_pages = math.ceil(result['totalRows'] / MAX_PAGE_SIZE)
+        pages = await asyncio.gather(*(
+            self.get_individual_vouchers_from_group(site_id, group_id, page=page, page_size=MAX_PAGE_SIZE,
+                                                    status_filter=status_filter)
+            for page in range(2, total_pages + 1)
+        ))
+        for page in pages:
+            rows = page_rows(page)
+            if rows is None:
+                return None
+            data.extend(rows)
+        
+        return dict(first, result=dict(result, data=data))
+    
+    async def delete_vouchers_batch(self, site_id: str, group_id: str, voucher_ids: List[str] = None, delete_type: int = 0, status_filter: int = None) -> Optional[Dict]:
+        """Delete selected vouchers from a group using batch delete API"""
+        payload = {
+            "type": delete_type,  # 0: all vouchers in group, 1: specific IDs, 2: exclude specific IDs
+            "groupId": group_id,
+        }
+        if voucher_ids and delete_type in [1, 2]:
+            payload["ids"] = voucher_ids
+        if status_filter is not None:
+            payload["status"] = status_filter
+        
+        logging.info(f"Batch deleting vouchers from group {group_id} for site {site_id} with type {delete_type}")
+        try:
+            return await self._request('POST', f"sites/{site_id}/hotspot/vouchers/batch/delete",
+                                       "batch deleting vouchers", json=payload)
+        finally:
+            self._sync.invalidate_cache(site_id, [group_id])
+    
+    async def delete_voucher_groups(self, site_id: str, group_ids: List[str], delete_type: int = 1) -> Optional[Dict]:
+        """Delete selected voucher groups (0=all groups, 1=selected groups, 2=all except selected)"""
+        data = {
+            "type": delete_type,
+            "groupIds": group_ids,
+            "searchKey": "",
+            "timeStart": 0
+        }
+        logging.info(f"Deleting voucher groups for site {site_id}: {group_ids}")
+        try:
+            return await self._request('POST', f"sites/{site_id}/hotspot/voucher-groups/batch/delete",
+                                       "deleting voucher groups", json=data)
+        finally:
+            self._sync.invalidate_cache(site_id, group_ids if delete_type == 1 else None)
@@ -0,0 +1,314 @@
+import copy
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, List, Optional
+
+# Responses kept by the memory and SQLite backends before the oldest are evicted
+CACHE_MAX_ENTRIES = int(os.environ.get("OMADA_CACHE_MAX_ENTRIES", "512"))
+
+# Last-good snapshots kept the same way, apart from responses so a sync can't evict them
+SNAPSHOT_MAX_ENTRIES = int(os.environ.get("OMADA_SNAPSHOT_MAX_ENTRIES", "256"))
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not cacheable")
+
+def _json_object_hook(obj: dict):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return date.fromisoformat(obj['__date__'])
+    return obj
+
+def dumps(value: Any) -> str:
+    """Serialize a cache value as JSON (dates included; tuples come back as lists)
+    
+    Shared backends never use pickle: whoever can write the store could
+    otherwise run code in every worker that reads it.
+    """
+    return json.dumps(value, default=_json_default)
+
+def loads(data) -> Any:
+    return json.loads(data, object_hook=_json_object_hook)
+
+def _open_private(path: str, flags: int = os.O_RDWR) -> int:
+    """Open (creating it 0600 if needed) a file only this user may use
+    
+    Refuses symlinks and files owned by another user or readable by others,
+    which another local user could have planted.
+    """
+    fd = os.open(path, flags | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    info = os.fstat(fd)
+    if info.st_uid != os.getuid():
+        os.close(fd)
+        raise PermissionError(f"{path} is owned by another user")
+    if info.st_mode & 0o077:
+        os.fchmod(fd, 0o600)
+    return fd
+
+class MemoryBackend:
+    """Size-bounded LRU of controller responses with a TTL per entry, in this process only
+    
+    Keys are (controller, site_id, group_id, endpoint, params); site_id and
+    group_id are None for entries that don't belong to a site or group.
+    Values are copied on the way in and out so callers can't change what
+    other callers see.
+    """
+    
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._locks = {}
+    
+    def get(self, key: tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+    
+    def set(self, key: tuple, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, controller: str, site_id: str, group_ids: Optional[List[str]] = None):
+        """Drop a site's entries after a write
+        
+        With group_ids, only the site-wide entries and those groups are
+        dropped; without, everything cached for the site goes.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] != controller or key[1] != site_id:
+                    continue
+                if group_ids is None or key[2] is None or key[2] in group_ids:
+                    del self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    @contextmanager
+    def lock(self, name: str):
+        """Mutual exclusion for name; threads of this process only"""
+        with self._lock:
+            named_lock = self._locks.setdefault(name, threading.Lock())
+        with named_lock:
+            yield
+
+class SQLiteBackend:
+    """Cache stored in a local SQLite file, shared by every worker on this machine
+    
+    The file (and its WAL files, which inherit its mode) is private to the
+    user running the app. Locks are flock()s on files next to the database,
+    so they hold across processes as well as threads.
+    """
+    
+    # Run the expiry/size cleanup once every this many writes
+    PURGE_EVERY = 50
+    
+    def __init__(self, path: str, max_entries: int = CACHE_MAX_ENTRIES, table: str = "omada_cache"):
+        self.path = path
+        self.table = table
+        self.max_entries = max(1, max_entries)
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        os.close(_open_private(path))
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, controller TEXT, site_id TEXT, group_id TEXT, "
+                "value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_site ON {table} (controller, site_id)")
+    
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread, never reused across a fork (gunicorn --preload)"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.conn = sqlite3.connect(self.path, timeout=10)
+            self._local.pid = os.getpid()
+        return self._local.conn
+    
+    @staticmethod
+    def _key(key: tuple) -> str:
+        return json.dumps(key, default=str)
+    
+    def get(self, key: tuple) -> Optional[Any]:
+        row = self._connect().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (self._key(key),)
+        ).fetchone()
+        if not row or row[1] <= time.time():
+            return None
+        try:
+            return loads(row[0])
+        except ValueError:
+            # Written in another format by an older version
+            return None
+    
+    def set(self, key: tuple, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, controller, site_id, group_id, value, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self._key(key), key[0], key[1], key[2], dumps(value), time.time() + ttl)
+            )
+        # Pool threads write at once: count under a lock so no purge is skipped or repeated
+        with self._writes_lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        if purge:
+            self._purge()
+    
+    def _purge(self):
+        """Delete expired entries, then the soonest-expiring ones over max_entries"""
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY expires_at "
+                f"LIMIT max(0, (SELECT count(*) FROM {self.table}) - ?))",
+                (self.max_entries,)
+            )
+    
+    def invalidate(self, controller: str, site_id: str, group_ids: Optional[List[str]] = None):
+        """Drop a site's entries after a write (see MemoryBackend.invalidate)"""
+        with self._connect() as conn:
+            if group_ids is None:
+                conn.execute(f"DELETE FROM {self.table} WHERE controller = ? AND site_id = ?", (controller, site_id))
+                return
+            placeholders = ", ".join("?" for _ in group_ids)
+            group_clause = f" OR group_id IN ({placeholders})" if group_ids else ""
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE controller = ? AND site_id = ? AND (group_id IS NULL{group_clause})",
+                (controller, site_id, *group_ids)
+            )
+    
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+    
+    @contextmanager
+    def lock(self, name: str):
+        """Mutual exclusion for name across all processes using this file"""
+        with os.fdopen(_open_private(f"{self.path}.{name}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class RedisBackend:
+    """Cache stored in Redis, shared by every worker on every app node
+    
+    Entries expire through Redis TTLs; Redis' own maxmemory policy bounds
+    the size.
+    """
+    
+    def __init__(self, url: str, prefix: str = "omada"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.client.ping()
+        self.prefix = prefix
+    
+    @staticmethod
+    def _digest(value) -> str:
+        return hashlib.sha1(json.dumps(value, default=str).encode()).hexdigest()[:16]
+    
+    def _key(self, key: tuple) -> str:
+        controller, site_id, group_id = key[:3]
+        return f"{self.prefix}:{self._digest(controller)}:{site_id or '-'}:{group_id or '-'}:{self._digest(key[3:])}"
+    
+    def get(self, key: tuple) -> Optional[Any]:
+        value = self.client.get(self._key(key))
+        if value is None:
+            return None
+        try:
+            return loads(value)
+        except ValueError:
+            # Written in another format by an older version
+            return None
+    
+    def set(self, key: tuple, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        self.client.set(self._key(key), dumps(value), px=int(ttl * 1000))
+    
+    def _delete_matching(self, pattern: str):
+        keys = list(self.client.scan_iter(match=pattern, count=500))
+        if keys:
+            self.client.delete(*keys)
+    
+    def invalidate(self, controller: str, site_id: str, group_ids: Optional[List[str]] = None):
+        """Drop a site's entries after a write (see MemoryBackend.invalidate)"""
+        site_prefix = f"{self.prefix}:{self._digest(controller)}:{site_id}"
+        if group_ids is None:
+            self._delete_matching(f"{site_prefix}:*")
+            return
+        for group_id in ['-', *group_ids]:
+            self._delete_matching(f"{site_prefix}:{group_id}:*")
+    
+    def clear(self):
+        self._delete_matching(f"{self.prefix}:*")
+    
+    @contextmanager
+    def lock(self, name: str):
+        """Mutual exclusion for name across every process using this Redis"""
+        with self.client.lock(f"{self.prefix}:lock:{name}", timeout=60, blocking_timeout=60):
+            yield
+
+def create_cache_backend(kind: str = "responses"):
+    """Build the backend selected by OMADA_CACHE_BACKEND (memory, sqlite or redis)
+    
+    kind is "responses" or "snapshots"; each gets a store of its own.
+    Falls back to the in-process memory backend if the selected one can't
+    be set up, so a cache problem never takes the app down.
+    """
+    backend = os.environ.get("OMADA_CACHE_BACKEND", "memory").strip().lower()
+    max_entries = SNAPSHOT_MAX_ENTRIES if kind == "snapshots" else CACHE_MAX_ENTRIES
+    try:
+        if backend == "sqlite":
+            # No default: a shared directory such as /tmp would let other
+            # local users read the token or plant entries
+            path = os.environ.get("OMADA_CACHE_PATH")
+            if not path:
+                raise ValueError("OMADA_CACHE_PATH must name a file in a directory private to the app user")
+            logging.info(f"Using SQLite Omada {kind} cache at {path}")
+            return SQLiteBackend(path, max_entries, table="omada_snapshots" if kind == "snapshots" else "omada_cache")
+        if backend == "redis":
+            url = os.environ.get("OMADA_CACHE_REDIS_URL") or os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+            logging.info(f"Using Redis Omada {kind} cache")
+            return RedisBackend(url, prefix="omada-snapshots" if kind == "snapshots" else "omada")
+        if backend != "memory":
+            logging.error(f"Unknown OMADA_CACHE_BACKEND '{backend}', using memory")
+    except Exception as e:
+        logging.error(f"Could not set up '{backend}' Omada {kind} cache, using memory: {str(e)}")
+    return MemoryBackend(max_entries)
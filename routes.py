@@ -2,16 +2,20 @@ from flask import render_template, request, redirect, url_for, flash, jsonify, m
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime, timedelta
+import asyncio
+import json
 import logging
+from sqlalchemy.exc import IntegrityError
 
 from app import app, db, login_manager
-from models import User, Site, AdminSite, VendorSite, VoucherPlan, VoucherGroup, OmadaConfig, CashRegister
+from models import User, Site, AdminSite, VendorSite, VoucherPlan, VoucherGroup, OmadaConfig, CashRegister, SiteSyncState, SyncJob
 from forms import (LoginForm, UserForm, VoucherPlanForm, VoucherGenerationForm, 
                   OmadaConfigForm, CashRegisterForm, UserEditForm, 
                   ChangePasswordForm, AdminChangePasswordForm, VoucherGroupEditForm,
                   ImportVoucherGroupsForm)
-from utils import generate_voucher_pdf, format_currency, format_duration, generate_sales_report_data, sync_sites_from_omada, sync_voucher_statuses_from_omada, has_permission, check_site_access, get_accessible_sites, can_manage_user, get_vendor_site_for_user
-from omada_api import omada_api
+from utils import generate_voucher_pdf, format_currency, format_duration, sync_sites_from_omada, filter_unclosed_vouchers, record_closed_vouchers, record_group_sales, remove_user_sales, get_sales_totals, has_permission, check_site_access, get_accessible_sites, can_manage_user, get_vendor_site_for_user
+from omada_api import omada_api, MAX_CONCURRENT_REQUESTS
+from omada_api_async import AsyncOmadaAPI
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -286,6 +290,10 @@ def omada_config():
             db.session.add(config)
         
         db.session.commit()
+        # Make the in-memory token holder pick up the new configuration
+        omada_api.reset_token_cache()
+        omada_api.breaker.reset()
+        omada_api.cache.clear()
         flash('Configuração do Omada Controller salva com sucesso.', 'success')
         return redirect(url_for('omada_config'))
     
@@ -390,6 +398,7 @@ def delete_admin(user_id):
     
     try:
         username = user.username
+        remove_user_sales(user)
         db.session.delete(user)
         db.session.commit()
         flash(f'Administrador {username} removido com sucesso.', 'success')
@@ -507,22 +516,8 @@ def admin_dashboard():
     
     total_plans = VoucherPlan.query.filter_by(site_id=current_site_id, is_active=True).count()
     
-    # Calculate vouchers generated vs sold
-    total_vouchers_generated = db.session.query(db.func.sum(VoucherGroup.quantity)).filter(
-        VoucherGroup.site_id == current_site_id
-    ).scalar() or 0
-    
-    # Calculate vouchers actually sold (used + expired)
-    total_vouchers_sold = db.session.query(
-        db.func.sum((VoucherGroup.used_count or 0) + (VoucherGroup.expired_count or 0))
-    ).filter(VoucherGroup.site_id == current_site_id).scalar() or 0
-    
-    # Calculate revenue based on sold vouchers
-    voucher_groups = VoucherGroup.query.filter_by(site_id=current_site_id).all()
-    total_revenue = sum(
-        ((vg.used_count or 0) + (vg.expired_count or 0)) * vg.plan.price 
-        for vg in voucher_groups
-    )
+    # Vouchers generated vs sold and revenue, from the sales rollups
+    sales = get_sales_totals(current_site_id)
     
     # Recent voucher activity
     recent_vouchers = VoucherGroup.query.filter_by(site_id=current_site_id).order_by(
@@ -534,9 +529,9 @@ def admin_dashboard():
                          admin_sites=admin_sites,
                          total_vendors=total_vendors,
                          total_plans=total_plans,
-                         total_vouchers_generated=total_vouchers_generated,
-                         total_vouchers_sold=total_vouchers_sold,
-                         total_revenue=total_revenue,
+                         total_vouchers_generated=sales['total_vouchers_generated'],
+                         total_vouchers_sold=sales['total_vouchers_sold'],
+                         total_revenue=sales['total_revenue'],
                          recent_vouchers=recent_vouchers)
 
 @app.route('/admin/vendors')
@@ -750,6 +745,7 @@ def delete_vendor(user_id):
     
     try:
         username = user.username
+        remove_user_sales(user)
         db.session.delete(user)
         db.session.commit()
         flash(f'Vendedor {username} removido com sucesso.', 'success')
@@ -1014,15 +1010,16 @@ def admin_sales_reports():
         end_date = datetime.strptime(end_date, '%Y-%m-%d')
     
     # Get individual sold vouchers directly from Omada Controller
-    from utils import get_sold_vouchers_from_omada
+    from utils import get_sold_vouchers_with_fallback
     
+    stale_since = None
     try:
         # Convert dates to proper format for Omada API
         start_date_filter = start_date.date() if start_date else None
         end_date_filter = end_date.date() if end_date else None
         
-        # Get all sold vouchers from Omada Controller
-        sold_vouchers = get_sold_vouchers_from_omada(current_site.site_id, start_date_filter, end_date_filter)
+        # Get all sold vouchers from Omada Controller (last good result if it is down)
+        sold_vouchers, stale_since = get_sold_vouchers_with_fallback(current_site.site_id, start_date_filter, end_date_filter)
         
         logging.info(f"Admin sales report: Found {len(sold_vouchers)} sold vouchers")
         
@@ -1055,7 +1052,8 @@ def admin_sales_reports():
                          total_sold_vouchers=total_sold_vouchers,
                          total_revenue=total_revenue,
                          start_date=start_date,
-                         end_date=end_date)
+                         end_date=end_date,
+                         stale_since=stale_since)
 
 # Admin Voucher Management (same as vendor functions)
 @app.route('/admin/create_vouchers')
@@ -1183,12 +1181,17 @@ def admin_generate_vouchers():
                     status='generated'
                 )
                 db.session.add(voucher_group)
+                db.session.flush()
+                record_group_sales([voucher_group])
                 db.session.commit()
                 
-                # Try to get real voucher codes after a short delay
+                # Try to get real voucher codes after a short delay; through the
+                # site's sync lease, so it never overlaps another sync (if one is
+                # running, it picks the new group up)
+                from sync_worker import sync_site
                 import time
                 time.sleep(2)
-                sync_voucher_statuses_from_omada(current_site_id)
+                sync_site(current_site_id)
                 
                 flash(f'{form.quantity.data} vouchers criados com sucesso!', 'success')
                 logging.info(f"Admin {current_user.username} created {form.quantity.data} vouchers for plan {plan.name}")
@@ -1264,30 +1267,18 @@ def cash_register():
     period_end = datetime.now()
     
     # Get individual sold vouchers from Omada Controller (status 1: in-use, 2: expired)
-    from utils import get_sold_vouchers_from_omada
+    from utils import get_sold_vouchers_with_fallback
+    stale_since = None
     try:
         # Convert date to proper format for Omada API
         start_date = period_start.date() if period_start else None
         end_date = period_end.date()
         
-        # Get all sold vouchers from Omada Controller
-        sold_vouchers = get_sold_vouchers_from_omada(current_site.site_id, start_date, end_date)
+        # Get all sold vouchers from Omada Controller (last good result if it is down)
+        sold_vouchers, stale_since = get_sold_vouchers_with_fallback(current_site.site_id, start_date, end_date)
         
         # Filter out vouchers that were already included in previous cash register closings
-        vouchers_for_cash_register = []
-        if last_closing and last_closing.voucher_data:
-            # Get list of voucher IDs that were already included in previous closings
-            already_included_ids = set()
-            all_closings = CashRegister.query.filter_by(site_id=current_site_id).all()
-            for closing in all_closings:
-                if closing.voucher_data:
-                    already_included_ids.update([v.get('id') for v in closing.voucher_data if v.get('id')])
-            
-            # Only include vouchers not in previous closings
-            vouchers_for_cash_register = [v for v in sold_vouchers if v.get('id') not in already_included_ids]
-        else:
-            # No previous closings, include all sold vouchers
-            vouchers_for_cash_register = sold_vouchers
+        vouchers_for_cash_register = filter_unclosed_vouchers(current_site_id, sold_vouchers)
             
     except Exception as e:
         logging.error(f"Error getting sold vouchers from Omada Controller: {str(e)}")
@@ -1334,6 +1325,7 @@ def cash_register():
                          total_vouchers=total_vouchers,
                          total_revenue=total_revenue,
                          last_closing=last_closing,
+                         stale_since=stale_since,
                          form=form)
 
 @app.route('/admin/close_cash_register', methods=['POST'])
@@ -1378,20 +1370,7 @@ def close_cash_register():
             sold_vouchers = get_sold_vouchers_from_omada(site.site_id, start_date, end_date)
             
             # Filter out vouchers that were already included in previous cash register closings
-            vouchers_to_close = []
-            if last_closing and last_closing.voucher_data:
-                # Get list of voucher IDs that were already included in previous closings
-                already_included_ids = set()
-                all_closings = CashRegister.query.filter_by(site_id=current_site_id).all()
-                for closing in all_closings:
-                    if closing.voucher_data:
-                        already_included_ids.update([v.get('id') for v in closing.voucher_data if v.get('id')])
-                
-                # Only include vouchers not in previous closings
-                vouchers_to_close = [v for v in sold_vouchers if v.get('id') not in already_included_ids]
-            else:
-                # No previous closings, include all sold vouchers
-                vouchers_to_close = sold_vouchers
+            vouchers_to_close = filter_unclosed_vouchers(current_site_id, sold_vouchers)
                 
         except Exception as e:
             logging.error(f"Error getting sold vouchers for cash register closure: {str(e)}")
@@ -1402,6 +1381,32 @@ def close_cash_register():
         total_vouchers = len(vouchers_to_close)
         total_revenue = sum(v.get('unit_price', 0) for v in vouchers_to_close)
         
+        # Create cash register record with individual voucher data
+        cash_register = CashRegister(
+            site_id=current_site_id,
+            closed_by_id=current_user.id,
+            period_start=period_start,
+            period_end=period_end,
+            vouchers_generated=0,  # Not applicable for individual voucher tracking
+            vouchers_sold=total_vouchers,
+            vouchers_expired=len([v for v in vouchers_to_close if v.get('status') == 2]),
+            vouchers_unused=0,  # Not applicable since we only track sold vouchers
+            total_revenue=total_revenue,
+            expired_vouchers_removed=False,
+            voucher_data=json.loads(json.dumps(vouchers_to_close, default=str)),  # Individual voucher data, dates as text for the JSON column
+            notes=form.notes.data
+        )
+        db.session.add(cash_register)
+        
+        # Claim the vouchers in the ledger before touching the controller, so
+        # a closing running at the same time can't count them again
+        try:
+            record_closed_vouchers(cash_register, vouchers_to_close)
+        except IntegrityError:
+            db.session.rollback()
+            flash('Alguns vouchers já foram incluídos em outro fechamento de caixa. Tente novamente.', 'warning')
+            return redirect(url_for('cash_register'))
+        
         # Delete sold vouchers from Omada Controller if requested
         vouchers_deleted = False
         vouchers_deleted_count = 0
@@ -1439,23 +1444,7 @@ def close_cash_register():
                 except Exception as e:
                     logging.error(f"Error deleting vouchers from group {group_id}: {str(e)}")
         
-        # Create cash register record with individual voucher data
-        cash_register = CashRegister(
-            site_id=current_site_id,
-            closed_by_id=current_user.id,
-            period_start=period_start,
-            period_end=period_end,
-            vouchers_generated=0,  # Not applicable for individual voucher tracking
-            vouchers_sold=total_vouchers,
-            vouchers_expired=len([v for v in vouchers_to_close if v.get('status') == 2]),
-            vouchers_unused=0,  # Not applicable since we only track sold vouchers
-            total_revenue=total_revenue,
-            expired_vouchers_removed=vouchers_deleted,
-            voucher_data=vouchers_to_close,  # Store individual voucher data instead of group data
-            notes=form.notes.data
-        )
-        
-        db.session.add(cash_register)
+        cash_register.expired_vouchers_removed = vouchers_deleted
         db.session.commit()
         
         success_message = f'Caixa fechado com sucesso! {total_vouchers} vouchers vendidos, receita: R$ {total_revenue:.2f}'.replace('.', ',')
@@ -1521,23 +1510,12 @@ def vendor_dashboard():
     # Get available plans for this site
     plans = VoucherPlan.query.filter_by(site_id=vendor_site.site_id, is_active=True).all()
     
-    # Get site statistics - all vouchers for the site (not just created by current user)
-    total_vouchers_generated = db.session.query(db.func.sum(VoucherGroup.quantity)).filter(
-        VoucherGroup.site_id == vendor_site.site_id
-    ).scalar() or 0
-    
-    # Calculate vouchers actually sold (used + expired) for all site vouchers
-    voucher_groups = VoucherGroup.query.filter_by(site_id=vendor_site.site_id).all()
-    total_vouchers_sold = sum((vg.used_count or 0) + (vg.expired_count or 0) for vg in voucher_groups)
-    total_revenue = sum(((vg.used_count or 0) + (vg.expired_count or 0)) * vg.plan.price for vg in voucher_groups)
+    # Get site statistics - all vouchers for the site (not just created by current user), from the sales rollups
+    sales = get_sales_totals(vendor_site.site_id)
     
     # Monthly sales based on sold vouchers for the site
-    start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    monthly_voucher_groups = VoucherGroup.query.filter(
-        VoucherGroup.site_id == vendor_site.site_id,
-        VoucherGroup.created_at >= start_of_month
-    ).all()
-    monthly_sales = sum(((vg.used_count or 0) + (vg.expired_count or 0)) * vg.plan.price for vg in monthly_voucher_groups)
+    start_of_month = datetime.now().date().replace(day=1)
+    monthly_sales = get_sales_totals(vendor_site.site_id, start_date=start_of_month)['total_revenue']
     
     recent_vouchers = VoucherGroup.query.filter_by(site_id=vendor_site.site_id).order_by(
         VoucherGroup.created_at.desc()
@@ -1546,9 +1524,9 @@ def vendor_dashboard():
     return render_template('vendor/dashboard.html',
                          site=vendor_site.site,
                          plans=plans,
-                         total_vouchers_generated=total_vouchers_generated,
-                         total_vouchers_sold=total_vouchers_sold,
-                         total_revenue=total_revenue,
+                         total_vouchers_generated=sales['total_vouchers_generated'],
+                         total_vouchers_sold=sales['total_vouchers_sold'],
+                         total_revenue=sales['total_revenue'],
                          monthly_sales=monthly_sales,
                          recent_vouchers=recent_vouchers)
 
@@ -1717,6 +1695,8 @@ def generate_vouchers():
                 )
                 
                 db.session.add(voucher_group)
+                db.session.flush()
+                record_group_sales([voucher_group])
                 db.session.commit()
                 
                 flash(f'{form.quantity.data} vouchers gerados com sucesso!', 'success')
@@ -1741,18 +1721,23 @@ def generate_vouchers():
 @app.route('/sync-voucher-status/<int:site_id>')
 @login_required
 def sync_voucher_status(site_id):
-    from utils import sync_voucher_statuses_from_omada
+    from sync_worker import enqueue_sync_job
+    from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
     
-    success = sync_voucher_statuses_from_omada(site_id)
+    if not check_site_access(site_id):
+        flash('Acesso negado ao site.', 'error')
+        return redirect(url_for('dashboard'))
     
-    if success:
-        flash('Status dos vouchers sincronizado com sucesso!', 'success')
-        logging.info(f"Voucher statuses synced for site {site_id} by {current_user.username}")
-    else:
-        flash('Erro ao sincronizar status dos vouchers. Verifique a conexão com o Omada Controller.', 'error')
-        logging.error(f"Failed to sync voucher statuses for site {site_id}")
+    # Manual syncs run in the background like /api/sync-vouchers: they re-read
+    # every group and count as this interval's scheduled sync. The page we
+    # go back to polls the job (auto-sync.js follows ?sync_job=<id>)
+    job = enqueue_sync_job('vouchers', site_id=site_id, user_id=current_user.id)
+    logging.info(f"Voucher sync job {job.id} for site {site_id} queued by {current_user.username}")
+    flash('Sincronização dos vouchers iniciada. A página será atualizada ao terminar.', 'info')
     
-    return redirect(request.referrer or url_for('dashboard'))
+    target = urlsplit(request.referrer or url_for('dashboard'))
+    query = [(key, value) for key, value in parse_qsl(target.query) if key != 'sync_job'] + [('sync_job', job.id)]
+    return redirect(urlunsplit(target._replace(query=urlencode(query))))
 
 @app.route('/vendor/voucher_history')
 @login_required
@@ -2118,6 +2103,7 @@ def delete_voucher_groups():
             
             if result and result.get('errorCode') == 0:
                 # Delete from local database
+                record_group_sales(voucher_groups, sign=-1)
                 for vg in voucher_groups:
                     db.session.delete(vg)
                 db.session.commit()
@@ -2179,15 +2165,17 @@ def api_sync_sites():
                 'error': 'Omada Controller not configured'
             }), 400
         
-        # Sync sites from Omada Controller
-        count = sync_sites_from_omada()
+        # Sync in the background; progress is polled on /api/sync-jobs/<id>
+        from sync_worker import enqueue_sync_job
+        job = enqueue_sync_job('sites', user_id=current_user.id)
         
-        logging.info(f"Sites synced successfully: {count}")
+        logging.info(f"Site sync job {job.id} queued by {current_user.username}")
         return jsonify({
             'success': True,
-            'count': count,
-            'message': f'{count} sites sincronizados'
-        })
+            'job_id': job.id,
+            'status': job.status,
+            'message': 'Sincronização de sites iniciada'
+        }), 202
     except Exception as e:
         logging.error(f"Error syncing sites: {str(e)}")
         return jsonify({
@@ -2195,6 +2183,39 @@ def api_sync_sites():
             'error': str(e)
         }), 500
 
+@app.route('/api/sync-all-sites', methods=['POST'])
+@login_required
+def api_sync_all_sites():
+    """Sync the vouchers of every site in parallel, in the background"""
+    try:
+        if current_user.user_type != 'master':
+            return jsonify({'error': 'Unauthorized - Only master users can sync all sites'}), 403
+        
+        omada_config = OmadaConfig.query.first()
+        if not omada_config or not omada_config.controller_url:
+            return jsonify({
+                'success': False,
+                'error': 'Omada Controller not configured'
+            }), 400
+        
+        # The consolidated report ends up in the job (/api/sync-jobs/<id>)
+        from sync_worker import enqueue_sync_job
+        job = enqueue_sync_job('all_sites', user_id=current_user.id)
+        
+        logging.info(f"All-sites voucher sync job {job.id} queued by {current_user.username}")
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'message': 'Sincronização de todos os sites iniciada'
+        }), 202
+    except Exception as e:
+        logging.error(f"Error syncing all sites: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/sync-vouchers/<int:site_id>', methods=['POST'])
 @login_required
 def api_sync_vouchers(site_id):
@@ -2227,15 +2248,18 @@ def api_sync_vouchers(site_id):
                 'error': 'Omada Controller not configured'
             }), 400
         
-        # Sync voucher statuses from Omada Controller
-        count = sync_voucher_statuses_from_omada(site_id)
+        # Manual sync in the background: re-reads every group and counts as this
+        # interval's scheduled sync; progress is polled on /api/sync-jobs/<id>
+        from sync_worker import enqueue_sync_job
+        job = enqueue_sync_job('vouchers', site_id=site_id, user_id=current_user.id)
         
-        logging.info(f"Vouchers synced for site {site_id}: {count}")
+        logging.info(f"Voucher sync job {job.id} for site {site_id} queued by {current_user.username}")
         return jsonify({
             'success': True,
-            'count': count,
-            'message': f'{count} vouchers sincronizados'
-        })
+            'job_id': job.id,
+            'status': job.status,
+            'message': 'Sincronização de vouchers iniciada'
+        }), 202
     except Exception as e:
         logging.error(f"Error syncing vouchers for site {site_id}: {str(e)}")
         return jsonify({
@@ -2246,17 +2270,32 @@ def api_sync_vouchers(site_id):
 @app.route('/api/sync-status')
 @login_required
 def api_sync_status():
-    """Get current sync status and statistics"""
+    """Get current sync status and statistics, as recorded by the sync worker"""
     try:
-        # Get last sync times from database or cache
+        last_site_sync = db.session.query(db.func.max(Site.last_sync)).scalar()
         stats = {
             'sites_count': Site.query.count(),
             'voucher_groups_count': VoucherGroup.query.count(),
-            'last_site_sync': None,  # Could be stored in a sync log table
+            'last_site_sync': last_site_sync.isoformat() if last_site_sync else None,
             'last_voucher_sync': None,
-            'sync_errors': 0
+            'sync_errors': SiteSyncState.query.filter_by(status='error').count(),
+            'site': None
         }
         
+        # Sync state of the site the page is showing
+        site_id = request.args.get('site_id', type=int)
+        if site_id and check_site_access(site_id):
+            state = SiteSyncState.query.filter_by(site_id=site_id).first()
+            if state:
+                now = datetime.utcnow()
+                stats['last_voucher_sync'] = state.last_success_at.isoformat() if state.last_success_at else None
+                stats['site'] = {
+                    'status': state.status,
+                    'last_success_seconds_ago': int((now - state.last_success_at).total_seconds()) if state.last_success_at else None,
+                    'next_sync_seconds': max(0, int((state.next_sync_at - now).total_seconds())) if state.next_sync_at else None,
+                    'last_error': state.last_error
+                }
+        
         return jsonify({
             'success': True,
             'stats': stats
@@ -2268,6 +2307,91 @@ def api_sync_status():
             'error': str(e)
         }), 500
 
+def _get_sync_job_for_user(job_id):
+    """Sync job if the current user may see it: master, whoever asked for it, or anyone with access to its site"""
+    job = SyncJob.query.get(job_id)
+    if not job:
+        return None
+    if current_user.user_type == 'master' or job.requested_by_id == current_user.id:
+        return job
+    if job.site_id and check_site_access(job.site_id):
+        return job
+    return None
+
+@app.route('/api/sync-jobs/<int:job_id>')
+@login_required
+def api_sync_job(job_id):
+    """Current state of a sync job"""
+    job = _get_sync_job_for_user(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+# Shortest code accepted for a prefix search
+VOUCHER_LOOKUP_MIN_PREFIX = 3
+
+@app.route('/vouchers/lookup')
+@login_required
+def voucher_lookup():
+    """Find a voucher by code in any of the user's sites"""
+    return render_template('voucher_lookup.html', min_prefix=VOUCHER_LOOKUP_MIN_PREFIX)
+
+@app.route('/api/vouchers/lookup')
+@login_required
+def api_voucher_lookup():
+    """Look vouchers up by code (exact or prefix) across the sites the user can access
+    
+    With refresh=1 and a single match, that voucher's status is re-read
+    from the Omada Controller first.
+    """
+    from utils import VOUCHER_STATUSES, lookup_vouchers, refresh_voucher_from_omada
+    
+    code = (request.args.get('code') or '').strip()
+    prefix = request.args.get('mode') == 'prefix'
+    if not code:
+        return jsonify({'success': False, 'error': 'Informe o código do voucher.'}), 400
+    if prefix and len(code) < VOUCHER_LOOKUP_MIN_PREFIX:
+        return jsonify({'success': False, 'error': f'Informe pelo menos {VOUCHER_LOOKUP_MIN_PREFIX} dígitos para buscar por prefixo.'}), 400
+    
+    try:
+        site_ids = None if current_user.user_type == 'master' else [site.id for site in get_accessible_sites()]
+        vouchers = lookup_vouchers(code, prefix=prefix, site_ids=site_ids)
+        
+        refreshed = False
+        if request.args.get('refresh') == '1' and len(vouchers) == 1:
+            try:
+                refreshed = refresh_voucher_from_omada(vouchers[0])
+            except Exception as e:
+                logging.error(f"Error refreshing voucher {vouchers[0].id} from Omada: {str(e)}")
+        
+        def fmt(value):
+            return value.strftime('%d/%m/%Y %H:%M') if value else None
+        
+        results = []
+        for voucher in vouchers:
+            group = voucher.voucher_group
+            status_text, status_class = VOUCHER_STATUSES.get(voucher.status, ('Desconhecido', 'secondary'))
+            results.append({
+                'code': voucher.code,
+                'status': voucher.status,
+                'status_text': status_text,
+                'status_class': status_class,
+                'site_name': voucher.site.name,
+                'plan_name': group.plan.name if group.plan else None,
+                'price': format_currency(group.plan.price) if group.plan else None,
+                'duration': format_duration(group.plan.duration, group.plan.duration_unit or 'minutes') if group.plan else None,
+                'created_by': group.created_by.username if group.created_by else None,
+                'group_created_at': fmt(group.created_at),
+                'used_at': fmt(voucher.used_at),
+                'expired_at': fmt(voucher.expired_at),
+                'last_sync': fmt(group.last_sync)
+            })
+        
+        return jsonify({'success': True, 'refreshed': refreshed, 'vouchers': results})
+    except Exception as e:
+        logging.error(f"Error looking up voucher code: {str(e)}")
+        return jsonify({'success': False, 'error': 'Erro ao buscar voucher.'}), 500
+
 @app.route('/admin/import-voucher-groups', methods=['GET', 'POST'])
 @login_required
 def import_voucher_groups():
@@ -2306,57 +2430,50 @@ def api_scan_missing_voucher_groups(site_id):
         
         site = Site.query.get_or_404(site_id)
         
-        # Get all voucher groups from Omada Controller
-        all_voucher_groups = []
-        page = 1
-        page_size = 100
-        
-        while True:
-            response = omada_api.get_voucher_groups(site.site_id, page=page, page_size=page_size)
-            
-            if not response or response.get('errorCode') != 0:
-                break
-            
-            result = response.get('result', {})
-            data = result.get('data', [])
-            
-            if not data:
-                break
-                
-            all_voucher_groups.extend(data)
-            
-            # Check if there are more pages
-            total_rows = result.get('totalRows', 0)
-            if len(all_voucher_groups) >= total_rows:
-                break
-                
-            page += 1
-        
         # Filter out groups that already exist locally
         missing_groups = []
-        existing_omada_ids = [vg.omada_group_id for vg in VoucherGroup.query.filter_by(site_id=site_id).all()]
-        
-        for group_data in all_voucher_groups:
-            omada_group_id = group_data.get('id')
-            if omada_group_id and omada_group_id not in existing_omada_ids:
-                # Get detailed information about this group
-                group_details = omada_api.get_voucher_group_detail(site.site_id, omada_group_id)
+        existing_omada_ids = {vg.omada_group_id for vg in VoucherGroup.query.filter_by(site_id=site_id).all()}
+        
+        # Stream all voucher groups from Omada Controller
+        missing_ids = [
+            group_data.get('id')
+            for group_data in omada_api.iter_items(omada_api.get_voucher_groups, site.site_id)
+            if group_data.get('id') and group_data.get('id') not in existing_omada_ids
+        ]
+        
+        # Get detailed information about all missing groups concurrently
+        # (bounded like the sync client so a large backlog can't flood the controller)
+        async def fetch_missing_details():
+            limit = asyncio.Semaphore(max(1, MAX_CONCURRENT_REQUESTS))
+            
+            async def fetch_detail(api, omada_group_id):
+                async with limit:
+                    return await api.get_full_voucher_group_detail(site.site_id, omada_group_id)
+            
+            async with AsyncOmadaAPI(max_connections=max(1, MAX_CONCURRENT_REQUESTS)) as api:
+                return await asyncio.gather(*(
+                    fetch_detail(api, omada_group_id)
+                    for omada_group_id in missing_ids
+                ))
+        
+        all_details = asyncio.run(fetch_missing_details()) if missing_ids else []
+        
+        for omada_group_id, group_details in zip(missing_ids, all_details):
+            if group_details and group_details.get('errorCode') == 0:
+                result_data = group_details.get('result', {})
+                group_info = result_data.get('groupInfo', {})
+                voucher_data_list = result_data.get('data', [])
                 
-                if group_details and group_details.get('errorCode') == 0:
-                    result_data = group_details.get('result', {})
-                    group_info = result_data.get('groupInfo', {})
-                    voucher_data_list = result_data.get('data', [])
-                    
-                    if voucher_data_list:
-                        missing_groups.append({
-                            'omada_id': omada_group_id,
-                            'name': group_info.get('name', 'Sem Nome'),
-                            'voucher_count': len(voucher_data_list),
-                            'duration': group_info.get('durationLimit', 60),
-                            'data_limit': group_info.get('dataLimit', 0),
-                            'group_info': group_info,
-                            'voucher_data': voucher_data_list
-                        })
+                if voucher_data_list:
+                    missing_groups.append({
+                        'omada_id': omada_group_id,
+                        'name': group_info.get('name', 'Sem Nome'),
+                        'voucher_count': len(voucher_data_list),
+                        'duration': group_info.get('durationLimit', 60),
+                        'data_limit': group_info.get('dataLimit', 0),
+                        'group_info': group_info,
+                        'voucher_data': voucher_data_list
+                    })
         
         return jsonify({
             'success': True,
@@ -2383,6 +2500,7 @@ def api_import_voucher_groups():
             return jsonify({'success': False, 'error': 'Acesso negado ao site'}), 403
         
         imported_count = 0
+        imported_groups = []
         
         for group_import in groups_to_import:
             group_data = group_import.get('group')
@@ -2424,8 +2542,11 @@ def api_import_voucher_groups():
             )
             
             db.session.add(voucher_group)
+            imported_groups.append(voucher_group)
             imported_count += 1
         
+        db.session.flush()
+        record_group_sales(imported_groups)
         db.session.commit()
         
         return jsonify({
@@ -2556,6 +2677,7 @@ def delete_voucher_group(group_id):
         
         # Delete from local database
         group_info = f"{voucher_group.plan.name} ({voucher_group.quantity} vouchers)"
+        record_group_sales([voucher_group], sign=-1)
         db.session.delete(voucher_group)
         db.session.commit()
         
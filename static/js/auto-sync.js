@@ -1,4 +1,6 @@
 // Auto-sync system for Omada Controller integration
+// Syncing itself is done on the server by "flask sync-worker"; the automatic
+// cycle here only reads the status, manual actions still trigger a sync.
 class AutoSyncManager {
     constructor() {
         this.syncInterval = 60000; // 1 minute
@@ -6,6 +8,8 @@ class AutoSyncManager {
         this.isEnabled = true;
         this.isSyncing = false;
         this.lastSyncTime = null;
+        this.lastServerSync = null;
+        this.serverSyncError = false;
         this.syncErrors = 0;
         this.maxErrors = 5;
         
@@ -33,6 +37,34 @@ class AutoSyncManager {
         
         // Update indicator
         this.updateSyncStatus();
+        this.refreshStatus();
+        this.followPageJob();
+    }
+    
+    async followPageJob() {
+        // Links that start a sync (e.g. /sync-voucher-status) come back with ?sync_job=<id>
+        const params = new URLSearchParams(window.location.search);
+        const jobId = params.get('sync_job');
+        if (!jobId) return;
+        
+        params.delete('sync_job');
+        const query = params.toString();
+        window.history.replaceState(null, '', window.location.pathname + (query ? `?${query}` : '') + window.location.hash);
+        
+        this.isSyncing = true;
+        this.updateSyncStatus();
+        try {
+            await this.waitForJob(jobId);
+            this.lastSyncTime = Date.now();
+            this.showNotification('Status dos vouchers sincronizado com sucesso!', 'success');
+            setTimeout(() => window.location.reload(), 1000);
+        } catch (error) {
+            console.error('Erro ao sincronizar status dos vouchers:', error);
+            this.showNotification('Erro ao sincronizar status dos vouchers. Verifique a conexão com o Omada Controller.', 'danger');
+        } finally {
+            this.isSyncing = false;
+            this.updateSyncStatus();
+        }
     }
     
     createSyncIndicator() {
@@ -134,8 +166,8 @@ class AutoSyncManager {
             syncIcon.parentElement.classList.add('text-muted');
         }
         
-        // Show error state if too many errors
-        if (this.syncErrors >= this.maxErrors) {
+        // Show error state if too many errors or the server's last sync failed
+        if (this.syncErrors >= this.maxErrors || this.serverSyncError) {
             syncIcon.parentElement.classList.remove('text-success', 'text-primary');
             syncIcon.parentElement.classList.add('text-danger');
             syncText.textContent = 'Erro de Sync';
@@ -151,7 +183,7 @@ class AutoSyncManager {
             this.performSync();
         }, this.syncInterval);
         
-        console.log('Auto-sync iniciado (1 minuto)');
+        console.log('Auto-sync iniciado (status a cada 1 minuto)');
     }
     
     stopAutoSync() {
@@ -189,9 +221,51 @@ class AutoSyncManager {
         await this.performSync(true);
     }
     
+    async refreshStatus() {
+        // Read the sync status recorded by the server-side sync worker
+        try {
+            const currentSite = this.getCurrentSiteId();
+            const query = currentSite ? `?site_id=${encodeURIComponent(currentSite)}` : '';
+            const response = await fetch(`/api/sync-status${query}`, {
+                credentials: 'same-origin',
+            });
+            
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            
+            const result = await response.json();
+            const site = result.stats && result.stats.site;
+            if (!site) return;
+            
+            this.serverSyncError = site.status === 'error';
+            if (site.last_success_seconds_ago !== null) {
+                this.lastSyncTime = Date.now() - site.last_success_seconds_ago * 1000;
+            }
+            
+            // New data arrived since the last look: refresh pages showing vouchers
+            const serverSync = result.stats.last_voucher_sync;
+            if (this.lastServerSync && serverSync && serverSync !== this.lastServerSync &&
+                window.location.pathname.includes('voucher')) {
+                this.refreshVoucherData();
+            }
+            this.lastServerSync = serverSync;
+        } catch (error) {
+            console.log('Sync status unavailable:', error.message);
+        } finally {
+            this.updateSyncStatus();
+        }
+    }
+    
     async performSync(manual = false) {
         if (this.isSyncing) return;
         
+        // Automatic cycles only read the status; the server does the syncing
+        if (!manual) {
+            await this.refreshStatus();
+            return;
+        }
+        
         this.isSyncing = true;
         this.updateSyncStatus();
         
@@ -300,10 +374,11 @@ class AutoSyncManager {
                 throw new Error(`HTTP ${response.status}: ${errorText}`);
             }
             
-            const result = await response.json();
+            const job = await this.waitForJob((await response.json()).job_id);
+            const result = { count: job.sites_synced || 0 };
             
             if (showNotification) {
-                this.showNotification(`Sites sincronizados: ${result.count || 0}`, 'success');
+                this.showNotification(`Sites sincronizados: ${result.count}`, 'success');
             }
             
             return result;
@@ -316,6 +391,47 @@ class AutoSyncManager {
         }
     }
     
+    async syncAllSites() {
+        // Master only: sync the vouchers of every site in parallel on the server
+        if (this.isSyncing) return;
+        this.isSyncing = true;
+        this.updateSyncStatus();
+        
+        try {
+            const csrfToken = this.getCSRFToken();
+            const response = await fetch('/api/sync-all-sites', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': csrfToken,
+                },
+                credentials: 'same-origin',
+            });
+            
+            if (!response.ok) {
+                const errorText = await response.text();
+                throw new Error(`HTTP ${response.status}: ${errorText}`);
+            }
+            
+            const job = await this.waitForJob((await response.json()).job_id);
+            const totals = (job.report && job.report.totals) || {};
+            const failed = (totals.error || 0) + (totals.timeout || 0);
+            this.showNotification(
+                `${totals.ok || 0} de ${totals.sites || 0} sites sincronizados` + (failed ? `, ${failed} com erro` : ''),
+                failed ? 'warning' : 'success'
+            );
+            this.lastSyncTime = Date.now();
+            return job.report;
+        } catch (error) {
+            console.error('Erro ao sincronizar todos os sites:', error);
+            this.showNotification('Erro ao sincronizar todos os sites', 'danger');
+            throw error;
+        } finally {
+            this.isSyncing = false;
+            this.updateSyncStatus();
+        }
+    }
+    
     async syncVouchers(showNotification = true) {
         try {
             // Get current site ID from page or session
@@ -340,10 +456,11 @@ class AutoSyncManager {
                 throw new Error(`HTTP ${response.status}: ${errorText}`);
             }
             
-            const result = await response.json();
+            const job = await this.waitForJob((await response.json()).job_id);
+            const result = { count: job.groups_synced || 0 };
             
             if (showNotification) {
-                this.showNotification(`Vouchers sincronizados: ${result.count || 0}`, 'success');
+                this.showNotification(`Vouchers sincronizados: ${result.count}`, 'success');
             }
             
             // Refresh current page if showing vouchers
@@ -361,6 +478,44 @@ class AutoSyncManager {
         }
     }
     
+    waitForJob(jobId) {
+        // Poll a background sync job until it finishes, showing its progress.
+        // Short requests keep the few web workers free for everyone else.
+        return new Promise((resolve, reject) => {
+            const poll = async () => {
+                try {
+                    const response = await fetch(`/api/sync-jobs/${jobId}`, { credentials: 'same-origin' });
+                    const result = await response.json();
+                    if (!result.success) throw new Error(result.error);
+                    if (result.job.status === 'error') {
+                        reject(new Error(result.job.error || 'Sync job failed'));
+                    } else if (result.job.status === 'done') {
+                        resolve(result.job);
+                    } else {
+                        this.showJobProgress(result.job);
+                        setTimeout(poll, 1500);
+                    }
+                } catch (error) {
+                    reject(error);
+                }
+            };
+            poll();
+        });
+    }
+    
+    showJobProgress(job) {
+        const syncText = document.getElementById('syncText');
+        if (!syncText || job.status !== 'running') return;
+        
+        if (job.job_type === 'vouchers') {
+            syncText.textContent = `Sincronizando... ${job.groups_seen} grupos`;
+        } else if (job.job_type === 'all_sites') {
+            syncText.textContent = `Sincronizando... ${job.sites_synced} sites`;
+        } else {
+            syncText.textContent = 'Sincronizando sites...';
+        }
+    }
+    
     getCSRFToken() {
         // Primary method: Get from Flask-WTF's hidden input in any form
         const csrfInput = document.querySelector('input[name="csrf_token"]');
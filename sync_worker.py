@@ -0,0 +1,499 @@
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+import click
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import AdminSite, Site, SiteSyncState, SyncJob, VendorSite
+
+# Seconds between voucher syncs of a site with normal activity. Sites with
+# changes are synced more often, down to SYNC_MIN_INTERVAL; quiet sites back
+# off by doubling, up to SYNC_MAX_INTERVAL.
+SYNC_INTERVAL = int(os.environ.get("OMADA_SYNC_INTERVAL", "60"))
+SYNC_MIN_INTERVAL = int(os.environ.get("OMADA_SYNC_MIN_INTERVAL", "30"))
+SYNC_MAX_INTERVAL = int(os.environ.get("OMADA_SYNC_MAX_INTERVAL", "1800"))
+
+# Seconds between syncs of the site list (0 disables)
+SITE_SYNC_INTERVAL = int(os.environ.get("OMADA_SITE_SYNC_INTERVAL", "600"))
+
+# Seconds the worker sleeps between looks for due sites
+WORKER_TICK = float(os.environ.get("OMADA_SYNC_TICK", "5"))
+
+# Seconds a sync lease lasts; a running sync renews it as it progresses, so
+# this only matters when a worker dies mid-sync
+SYNC_LOCK_TTL = int(os.environ.get("OMADA_SYNC_LOCK_TTL", "300"))
+
+# Sites synced at once by "sync all sites", seconds each site may take
+# before its sync is abandoned, and seconds the whole run may take (sites
+# not started by then are reported as timed out; 0 for no limit).
+# Controller requests stay capped by OMADA_MAX_CONCURRENT_REQUESTS however
+# many sites run.
+SYNC_ALL_WORKERS = int(os.environ.get("OMADA_SYNC_ALL_WORKERS", "8"))
+SYNC_SITE_TIMEOUT = int(os.environ.get("OMADA_SYNC_SITE_TIMEOUT", "600"))
+SYNC_ALL_TIMEOUT = int(os.environ.get("OMADA_SYNC_ALL_TIMEOUT", "1800"))
+
+# Sync jobs requested from the UI run on this many threads per web worker
+SYNC_JOB_WORKERS = int(os.environ.get("OMADA_SYNC_JOB_WORKERS", "2"))
+
+# Seconds between progress writes of a running job
+JOB_PROGRESS_INTERVAL = 1.0
+
+# Queued or running jobs older than this are considered dead (worker restarted)
+JOB_STALE_AFTER = timedelta(minutes=30)
+
+# Finished jobs are deleted after this long
+JOB_RETENTION = timedelta(days=7)
+
+_job_executor = ThreadPoolExecutor(max_workers=max(1, SYNC_JOB_WORKERS), thread_name_prefix='sync-job')
+
+def get_sync_state(site_id: int) -> SiteSyncState:
+    """Get the sync state of a site, creating it if needed"""
+    state = SiteSyncState.query.filter_by(site_id=site_id).first()
+    if state:
+        return state
+    
+    try:
+        state = SiteSyncState(site_id=site_id, status='idle', sync_interval=SYNC_INTERVAL, consecutive_failures=0)
+        db.session.add(state)
+        db.session.commit()
+        return state
+    except IntegrityError:
+        # Created by another process in the meantime
+        db.session.rollback()
+        return SiteSyncState.query.filter_by(site_id=site_id).first()
+
+def _claim_site(site_id: int, now: datetime) -> bool:
+    """Atomically take a due site, so no other worker syncs it in this interval"""
+    result = db.session.execute(
+        update(SiteSyncState)
+        .where(SiteSyncState.site_id == site_id)
+        .where(or_(SiteSyncState.next_sync_at.is_(None), SiteSyncState.next_sync_at <= now))
+        .values(next_sync_at=now + timedelta(seconds=SYNC_INTERVAL), status='running', last_started_at=now)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+class SyncLockLost(Exception):
+    """The sync lease of a site expired and was taken by another worker"""
+
+def acquire_site_lock(site_id: int) -> Optional[str]:
+    """Take the sync lease of a site; returns the lease token, or None if another worker holds it
+    
+    The lease is a row in site_sync_state, so it holds across workers and
+    nodes sharing the database without any other service.
+    """
+    get_sync_state(site_id)
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(SiteSyncState)
+        .where(SiteSyncState.site_id == site_id)
+        .where(or_(SiteSyncState.lock_expires_at.is_(None), SiteSyncState.lock_expires_at <= now))
+        .values(lock_owner=token, lock_expires_at=now + timedelta(seconds=SYNC_LOCK_TTL),
+                status='running', last_started_at=now)
+    )
+    db.session.commit()
+    return token if result.rowcount == 1 else None
+
+def renew_site_lock(site_id: int, token: str):
+    """Extend a lease we hold; raises SyncLockLost if it is no longer ours
+    
+    Runs on a connection of its own: it is called in the middle of a sync,
+    whose session must not be committed from here.
+    """
+    with db.engine.begin() as conn:
+        result = conn.execute(
+            update(SiteSyncState)
+            .where(SiteSyncState.site_id == site_id, SiteSyncState.lock_owner == token)
+            .values(lock_expires_at=datetime.utcnow() + timedelta(seconds=SYNC_LOCK_TTL))
+        )
+    if result.rowcount != 1:
+        raise SyncLockLost(f"Sync lease of site {site_id} was lost")
+
+def release_site_lock(site_id: int, token: str):
+    """Give a lease back, unless it has already passed to someone else"""
+    db.session.execute(
+        update(SiteSyncState)
+        .where(SiteSyncState.site_id == site_id, SiteSyncState.lock_owner == token)
+        .values(lock_owner=None, lock_expires_at=None)
+    )
+    db.session.commit()
+
+def wait_for_site_sync(site_id: int, timeout: float = SYNC_LOCK_TTL) -> bool:
+    """Wait for the sync another worker is running on a site; returns whether it succeeded"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = SiteSyncState.query.filter_by(site_id=site_id).populate_existing().first()
+        free = not state or not state.lock_expires_at or state.lock_expires_at <= datetime.utcnow()
+        succeeded = bool(state) and state.status == 'ok'
+        db.session.rollback()
+        if free:
+            return succeeded
+        time.sleep(1)
+    return False
+
+def next_interval(state: SiteSyncState, stats) -> int:
+    """Seconds until the next sync of a site, adapted to what the last sync saw
+    
+    Failures back off exponentially from SYNC_INTERVAL. Successful syncs
+    halve the interval when groups changed and double it when nothing did.
+    """
+    if not stats:
+        return min(SYNC_MAX_INTERVAL, SYNC_INTERVAL * 2 ** min(state.consecutive_failures or 1, 10))
+    
+    interval = state.sync_interval or SYNC_INTERVAL
+    if stats.get('groups_changed'):
+        return max(SYNC_MIN_INTERVAL, interval // 2)
+    return min(SYNC_MAX_INTERVAL, interval * 2)
+
+def sync_site(site_id: int, force: bool = False, progress: Optional[Callable[[Dict], None]] = None,
+              deadline: Optional[float] = None):
+    """Sync the vouchers of one site now and record the outcome in its SiteSyncState
+    
+    force is used for manual syncs: every group is re-read and the site
+    goes back to at most the normal interval. A sync still reading past
+    deadline (time.monotonic()) fails. Returns the sync counters, False if
+    the sync failed, or None if another worker is already syncing the site.
+    """
+    from utils import sync_voucher_statuses_from_omada
+    
+    token = acquire_site_lock(site_id)
+    if not token:
+        logging.info(f"Site {site_id} is already being synced, skipping")
+        return None
+    
+    started = time.monotonic()
+    last_renewal = started
+    
+    def renew_and_report(stats: Dict):
+        nonlocal last_renewal
+        if time.monotonic() - last_renewal >= SYNC_LOCK_TTL / 3:
+            renew_site_lock(site_id, token)
+            last_renewal = time.monotonic()
+        if progress:
+            progress(stats)
+    
+    error = None
+    try:
+        try:
+            stats = sync_voucher_statuses_from_omada(site_id, force=force, progress=renew_and_report, deadline=deadline)
+        except Exception as e:
+            logging.error(f"Error syncing site {site_id}: {str(e)}")
+            db.session.rollback()
+            stats = False
+            error = str(e)
+        
+        finished_at = datetime.utcnow()
+        state = get_sync_state(site_id)
+        state.status = 'ok' if stats else 'error'
+        state.last_finished_at = finished_at
+        state.last_duration = time.monotonic() - started
+        state.last_error = None if stats else (error or 'Falha ao sincronizar com o Omada Controller')
+        if stats:
+            state.last_success_at = finished_at
+            state.last_changes = stats.get('groups_changed', 0)
+            state.consecutive_failures = 0
+        else:
+            state.consecutive_failures = (state.consecutive_failures or 0) + 1
+        
+        interval = next_interval(state, stats)
+        if force:
+            # Someone is looking at this site right now
+            interval = min(interval, SYNC_INTERVAL)
+        if stats:
+            state.sync_interval = interval
+        # Any sync, manual or scheduled, counts for this interval
+        state.next_sync_at = finished_at + timedelta(seconds=interval)
+        db.session.commit()
+    finally:
+        release_site_lock(site_id, token)
+    
+    logging.debug(f"Site {site_id} next sync in {interval}s")
+    return stats
+
+def scheduled_site_ids():
+    """Sites the worker keeps in sync: those assigned to at least one admin or vendor"""
+    admin_site_ids = db.session.query(AdminSite.site_id)
+    vendor_site_ids = db.session.query(VendorSite.site_id)
+    return [site_id for (site_id,) in admin_site_ids.union(vendor_site_ids).all()]
+
+def run_due_syncs() -> int:
+    """Sync every scheduled site whose interval has passed; returns how many were synced"""
+    site_ids = scheduled_site_ids()
+    for site_id in site_ids:
+        get_sync_state(site_id)
+    
+    now = datetime.utcnow()
+    due_states = SiteSyncState.query.filter(
+        SiteSyncState.site_id.in_(site_ids),
+        or_(SiteSyncState.next_sync_at.is_(None), SiteSyncState.next_sync_at <= now)
+    ).order_by(SiteSyncState.next_sync_at).all()
+    
+    synced = 0
+    for state in due_states:
+        if not _claim_site(state.site_id, now):
+            continue
+        if sync_site(state.site_id) is not None:
+            synced += 1
+    return synced
+
+def _sync_site_for_report(site_id: int, force: bool, timeout: float, run_deadline: Optional[float] = None) -> Dict:
+    """Sync one site for sync_all_sites, returning its line of the report"""
+    with app.app_context():
+        site = db.session.get(Site, site_id)
+        started = time.monotonic()
+        line = {
+            'site_id': site_id,
+            'name': site.name if site else None,
+            'status': 'timeout',
+            'groups_seen': 0,
+            'groups_changed': 0,
+            'groups_synced': 0,
+            'duration': 0.0,
+            'error': None
+        }
+        
+        # Sites whose turn comes after the run's deadline are not started
+        if run_deadline is not None and started >= run_deadline:
+            line['error'] = "Tempo limite da sincronização de todos os sites excedido antes do início"
+            return line
+        
+        deadline = started + timeout
+        if run_deadline is not None and run_deadline < deadline:
+            deadline = run_deadline
+        
+        stats = sync_site(site_id, force=force, deadline=deadline)
+        finished = time.monotonic()
+        if stats is None:
+            status = 'busy'
+        elif stats:
+            status = 'ok'
+        else:
+            status = 'timeout' if finished > deadline else 'error'
+        error = None
+        if status == 'timeout':
+            error = (f"Tempo limite de {timeout}s excedido" if deadline - started >= timeout else
+                     "Tempo limite da sincronização de todos os sites excedido")
+        elif status == 'error':
+            state = SiteSyncState.query.filter_by(site_id=site_id).first()
+            error = state.last_error if state else None
+        
+        line.update(
+            status=status,
+            groups_seen=stats.get('groups_seen', 0) if stats else 0,
+            groups_changed=stats.get('groups_changed', 0) if stats else 0,
+            groups_synced=stats.get('groups_synced', 0) if stats else 0,
+            duration=round(finished - started, 2),
+            error=error
+        )
+        return line
+
+def sync_all_sites(site_ids=None, force: bool = False, max_workers: int = SYNC_ALL_WORKERS,
+                   timeout: float = SYNC_SITE_TIMEOUT, on_site_done: Optional[Callable[[Dict], None]] = None,
+                   total_timeout: float = SYNC_ALL_TIMEOUT) -> Dict:
+    """Sync the vouchers of many sites in parallel and return a consolidated report
+    
+    Sites (all of them by default) run on a pool of max_workers threads;
+    each one is given up after timeout seconds, and all of them once the
+    run has taken total_timeout seconds (0: no limit). Sites given up or
+    never started are reported as timeouts. on_site_done, if given, is
+    called on this thread with each site's report line as it finishes.
+    """
+    if site_ids is None:
+        site_ids = [site_id for (site_id,) in db.session.query(Site.id).order_by(Site.name)]
+    
+    started_at = datetime.utcnow()
+    started = time.monotonic()
+    run_deadline = started + total_timeout if total_timeout else None
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='sync-all') as executor:
+        futures = {executor.submit(_sync_site_for_report, site_id, force, timeout, run_deadline): site_id
+                   for site_id in site_ids}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Error syncing site {futures[future]}: {str(e)}")
+                result = {'site_id': futures[future], 'name': None, 'status': 'error', 'groups_seen': 0,
+                          'groups_changed': 0, 'groups_synced': 0, 'duration': None, 'error': str(e)}
+            results.append(result)
+            if on_site_done:
+                on_site_done(result)
+    
+    results.sort(key=lambda r: (r['status'] == 'ok', r['name'] or ''))
+    totals = {status: sum(1 for r in results if r['status'] == status) for status in ('ok', 'error', 'timeout', 'busy')}
+    totals.update(
+        sites=len(results),
+        groups_synced=sum(r['groups_synced'] for r in results),
+        groups_changed=sum(r['groups_changed'] for r in results)
+    )
+    duration = time.monotonic() - started
+    logging.info(f"Synced {totals['ok']}/{totals['sites']} sites in {duration:.1f}s "
+                 f"({totals['error']} errors, {totals['timeout']} timeouts, {totals['busy']} already syncing)")
+    return {
+        'started_at': started_at.isoformat(),
+        'duration': round(duration, 2),
+        'totals': totals,
+        'sites': results
+    }
+
+def enqueue_sync_job(job_type: str, site_id: Optional[int] = None, user_id: Optional[int] = None) -> SyncJob:
+    """Queue a manual sync and start it in the background
+    
+    If the same sync is already queued or running, that job is returned
+    instead of starting a second one.
+    """
+    now = datetime.utcnow()
+    SyncJob.query.filter(SyncJob.finished_at < now - JOB_RETENTION).delete(synchronize_session=False)
+    
+    job = SyncJob.query.filter(
+        SyncJob.job_type == job_type,
+        SyncJob.site_id == site_id,
+        SyncJob.status.in_(['queued', 'running']),
+        SyncJob.created_at >= now - JOB_STALE_AFTER
+    ).order_by(SyncJob.created_at.desc()).first()
+    if job:
+        db.session.commit()
+        return job
+    
+    job = SyncJob(job_type=job_type, site_id=site_id, requested_by_id=user_id, status='queued', created_at=now)
+    db.session.add(job)
+    db.session.commit()
+    
+    _job_executor.submit(_run_sync_job, job.id)
+    return job
+
+def _update_job(job_id: int, **values):
+    """Write job progress on a connection of their own, leaving the sync's session alone
+    
+    Progress is informational, so a failed write is only logged.
+    """
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(update(SyncJob).where(SyncJob.id == job_id).values(**values))
+    except Exception as e:
+        logging.warning(f"Could not write progress of sync job {job_id}: {str(e)}")
+
+def _run_sync_job(job_id: int):
+    """Run a queued SyncJob, writing its progress as it goes"""
+    from utils import sync_sites_from_omada
+    
+    with app.app_context():
+        job = db.session.get(SyncJob, job_id)
+        if not job:
+            return
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+        
+        started = time.monotonic()
+        last_write = started
+        counters = {}
+        
+        def progress(stats: Dict):
+            nonlocal last_write
+            for field in ('groups_seen', 'groups_synced', 'groups_changed', 'groups_imported'):
+                counters[field] = stats.get(field, 0)
+            if time.monotonic() - last_write >= JOB_PROGRESS_INTERVAL:
+                _update_job(job_id, **counters)
+                last_write = time.monotonic()
+        
+        try:
+            if job.job_type == 'sites':
+                counters['sites_synced'] = sync_sites_from_omada() or 0
+                success = True
+            elif job.job_type == 'all_sites':
+                def site_done(result: Dict):
+                    counters['sites_synced'] = counters.get('sites_synced', 0) + 1
+                    for field in ('groups_seen', 'groups_synced', 'groups_changed'):
+                        counters[field] = counters.get(field, 0) + result[field]
+                    _update_job(job_id, **counters)
+                
+                counters['report'] = sync_all_sites(force=True, on_site_done=site_done)
+                success = True
+            else:
+                stats = sync_site(job.site_id, force=True, progress=progress)
+                if stats is None:
+                    # Someone else is syncing this site right now: join their result
+                    logging.info(f"Sync job {job_id} waiting for the running sync of site {job.site_id}")
+                    success = wait_for_site_sync(job.site_id)
+                else:
+                    success = bool(stats)
+            error = None if success else 'Falha ao sincronizar com o Omada Controller'
+        except Exception as e:
+            logging.error(f"Error running sync job {job_id}: {str(e)}")
+            db.session.rollback()
+            error = str(e)
+        
+        job = db.session.get(SyncJob, job_id, populate_existing=True)
+        for field, value in counters.items():
+            setattr(job, field, value)
+        job.status = 'error' if error else 'done'
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        job.duration = time.monotonic() - started
+        db.session.commit()
+        logging.info(f"Sync job {job_id} ({job.job_type}) finished with status {job.status} in {job.duration:.1f}s")
+
+def run_sync_worker(once: bool = False):
+    """Keep all scheduled sites in sync until interrupted"""
+    from utils import sync_sites_from_omada
+    
+    logging.info(f"Sync worker started: sites every {SYNC_MIN_INTERVAL}-{SYNC_MAX_INTERVAL}s "
+                 f"(normally {SYNC_INTERVAL}s), site list every {SITE_SYNC_INTERVAL}s")
+    last_site_list_sync = None
+    
+    while True:
+        with app.app_context():
+            if SITE_SYNC_INTERVAL > 0 and (last_site_list_sync is None or
+                                           time.monotonic() - last_site_list_sync >= SITE_SYNC_INTERVAL):
+                try:
+                    sync_sites_from_omada()
+                except Exception as e:
+                    # Controller down or rejecting us: keep syncing the sites we know
+                    logging.error(f"Error refreshing the site list: {str(e)}")
+                    db.session.rollback()
+                last_site_list_sync = time.monotonic()
+            
+            synced = run_due_syncs()
+            if synced:
+                logging.info(f"Sync worker synced {synced} sites")
+        
+        if once:
+            return
+        time.sleep(WORKER_TICK)
+
+@app.cli.command('sync-all-sites')
+@click.option('--force', is_flag=True, help='Re-read every group, even those whose counters did not change.')
+@click.option('--workers', default=SYNC_ALL_WORKERS, show_default=True, help='Sites synced at once.')
+@click.option('--timeout', default=SYNC_SITE_TIMEOUT, show_default=True, help='Seconds before a site is given up.')
+@click.option('--total-timeout', default=SYNC_ALL_TIMEOUT, show_default=True,
+              help='Seconds before every site still syncing or waiting is given up (0 for no limit).')
+def sync_all_sites_command(force, workers, timeout, total_timeout):
+    """Sync the vouchers of every site now, in parallel, and print a report"""
+    report = sync_all_sites(force=force, max_workers=workers, timeout=timeout, total_timeout=total_timeout)
+    for line in report['sites']:
+        error = f"  {line['error']}" if line['error'] else ''
+        click.echo(f"{line['status']:8} {line['name'] or line['site_id']}: {line['groups_synced']} groups synced, "
+                   f"{line['groups_changed']} changed, {line['duration']}s{error}")
+    totals = report['totals']
+    click.echo(f"{totals['ok']}/{totals['sites']} sites ok, {totals['error']} errors, {totals['timeout']} timeouts, "
+               f"{totals['busy']} already syncing; {totals['groups_synced']} groups in {report['duration']}s")
+    if totals['error'] or totals['timeout']:
+        raise SystemExit(1)
+
+@app.cli.command('sync-worker')
+@click.option('--once', is_flag=True, help='Sync the sites that are due and exit.')
+def sync_worker_command(once):
+    """Sync voucher groups of all assigned sites with the Omada Controller on a schedule"""
+    try:
+        run_sync_worker(once=once)
+    except KeyboardInterrupt:
+        logging.info("Sync worker stopped")
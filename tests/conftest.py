@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+_db_dir = tempfile.mkdtemp(prefix='voucher-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault('SESSION_SECRET', 'test-secret')
+os.environ['OMADA_CACHE_BACKEND'] = 'memory'
+
+from app import app as flask_app, db  # noqa: E402
+import routes  # noqa: E402,F401
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        # Enforce foreign keys like MySQL/InnoDB does
+        @event.listens_for(db.engine, 'connect')
+        def _enable_foreign_keys(dbapi_connection, connection_record):
+            dbapi_connection.execute('PRAGMA foreign_keys=ON')
+        db.engine.dispose()
+        
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        event.remove(db.engine, 'connect', _enable_foreign_keys)
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user, site=None):
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user.id)
+        if site is not None:
+            sess['selected_site_id'] = site.id
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from omada_api import MAX_PAGE_SIZE, omada_api
+from omada_api_async import AsyncOmadaAPI
+
+VOUCHERS = [{'id': f'v{i}', 'code': f'{i:08d}', 'status': 0} for i in range(2 * MAX_PAGE_SIZE + 500)]
+
+
+def _page(page, page_size, total_rows):
+    result = {'data': VOUCHERS[(page - 1) * page_size:page * page_size], 'groupInfo': {'name': 'g1'}}
+    if total_rows is not None:
+        result['totalRows'] = total_rows
+    return {'errorCode': 0, 'result': result}
+
+
+@pytest.mark.parametrize('total_rows', [None, 0, len(VOUCHERS)])
+def test_full_group_detail_reads_every_page(app, monkeypatch, total_rows):
+    monkeypatch.setattr(omada_api, 'get_individual_vouchers_from_group',
+                        lambda site_id, group_id, page=1, page_size=1000, status_filter=None: _page(page, page_size, total_rows))
+    
+    detail = omada_api.get_full_voucher_group_detail('s1', 'g1')
+    
+    assert detail['result']['data'] == VOUCHERS
+
+
+@pytest.mark.parametrize('total_rows', [None, 0, len(VOUCHERS)])
+def test_async_full_group_detail_reads_every_page(app, monkeypatch, total_rows):
+    async def get_page(self, site_id, group_id, page=1, page_size=1000, status_filter=None, search_key=None):
+        return _page(page, page_size, total_rows)
+    monkeypatch.setattr(AsyncOmadaAPI, 'get_individual_vouchers_from_group', get_page)
+    
+    async def fetch():
+        async with AsyncOmadaAPI() as api:
+            return await api.get_full_voucher_group_detail('s1', 'g1')
+    
+    assert asyncio.run(fetch())['result']['data'] == VOUCHERS
@@ -0,0 +1,21 @@
+import threading
+
+from omada_cache import SQLiteBackend
+
+
+def test_sqlite_backend_purges_once_per_batch_of_concurrent_writes(tmp_path, monkeypatch):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite3'))
+    purges = []
+    monkeypatch.setattr(backend, '_purge', lambda: purges.append(1))
+    
+    def write(thread):
+        for i in range(SQLiteBackend.PURGE_EVERY):
+            backend.set(('controller', 's1', None, f'{thread}-{i}', ()), {'errorCode': 0}, 60)
+    
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(purges) == 8
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+
+import omada_api as omada_api_module
+from app import db
+from models import OmadaConfig
+from omada_api import omada_api
+
+
+def test_config_saved_by_another_process_is_picked_up(app, monkeypatch):
+    config = OmadaConfig(controller_url='https://old:8043', client_id='c', client_secret='s', omadac_id='cid',
+                         access_token='token', token_expires_at=datetime.utcnow() + timedelta(hours=1))
+    db.session.add(config)
+    db.session.commit()
+    omada_api.reset_token_cache()
+    assert omada_api._ensure_valid_token()
+    assert omada_api.base_url == 'https://old:8043'
+    
+    # Saved by another worker: this process' tokens are never reset
+    with db.engine.begin() as conn:
+        conn.execute(OmadaConfig.__table__.update().values(
+            controller_url='https://new:8043', updated_at=datetime.utcnow() + timedelta(seconds=1)))
+    
+    assert omada_api._ensure_valid_token()
+    assert omada_api.base_url == 'https://old:8043'  # not checked again yet
+    
+    monkeypatch.setattr(omada_api_module, 'CONFIG_CHECK_INTERVAL', 0)
+    assert omada_api._ensure_valid_token()
+    assert omada_api.base_url == 'https://new:8043'
+    omada_api.reset_token_cache()
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from app import db
+from models import Site
+from omada_api import MAX_PAGE_SIZE, omada_api
+from sync_worker import sync_all_sites
+
+
+@pytest.fixture
+def stalled_controller(monkeypatch):
+    """One group per site whose pages keep coming, slowly, without a totalRows"""
+    def iter_items(func, site_id, **kwargs):
+        yield {'id': f'{site_id}-g1'}
+    
+    def get_individual_vouchers_from_group(site_id, group_id, page=1, page_size=1000, status_filter=None):
+        time.sleep(0.05)
+        vouchers = [{'id': f'{group_id}-{page}-{i}', 'code': f'{page:04d}{i:04d}', 'status': 0} for i in range(page_size)]
+        return {'errorCode': 0, 'result': {'data': vouchers}}
+    
+    monkeypatch.setattr(omada_api, 'iter_items', iter_items)
+    monkeypatch.setattr(omada_api, 'get_individual_vouchers_from_group', get_individual_vouchers_from_group)
+
+
+def _sites(count):
+    sites = [Site(site_id=f's{n}', name=f'Site {n}') for n in range(count)]
+    db.session.add_all(sites)
+    db.session.commit()
+    return [site.id for site in sites]
+
+
+def test_site_stalled_between_progress_callbacks_times_out(app, stalled_controller):
+    site_ids = _sites(1)
+    
+    started = time.monotonic()
+    report = sync_all_sites(site_ids, timeout=0.5, total_timeout=0)
+    
+    assert time.monotonic() - started < 2
+    assert report['totals']['timeout'] == 1
+    assert report['sites'][0]['error'] == 'Tempo limite de 0.5s excedido'
+
+
+def test_sites_not_started_by_the_run_deadline_are_reported(app, stalled_controller):
+    site_ids = _sites(3)
+    
+    started = time.monotonic()
+    report = sync_all_sites(site_ids, max_workers=1, timeout=60, total_timeout=0.5)
+    
+    assert time.monotonic() - started < 2
+    assert report['totals']['timeout'] == 3
+    not_started = [line for line in report['sites'] if line['duration'] == 0]
+    assert len(not_started) == 2
+    assert all('antes do início' in line['error'] for line in not_started)
@@ -0,0 +1,32 @@
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import sync_worker
+from app import db
+from conftest import login
+from models import AdminSite, Site, SyncJob, User
+
+
+def test_sync_voucher_status_queues_a_job(client, monkeypatch):
+    site = Site(site_id='s1', name='Site 1')
+    admin = User(username='admin', email='admin@example.com', password_hash='x', user_type='admin')
+    db.session.add_all([site, admin])
+    db.session.flush()
+    db.session.add(AdminSite(admin_id=admin.id, site_id=site.id))
+    db.session.commit()
+    started = []
+    monkeypatch.setattr(sync_worker._job_executor, 'submit', lambda func, *args: started.append((func, args)))
+    monkeypatch.setattr(sync_worker, 'sync_site', lambda *args, **kwargs: pytest.fail('synced inside the request'))
+    login(client, admin, site)
+    
+    response = client.get(f'/sync-voucher-status/{site.id}', headers={'Referer': 'http://localhost/vendor/voucher_history?plan_id=3'})
+    
+    assert response.status_code == 302
+    location = urlsplit(response.headers['Location'])
+    assert location.path == '/vendor/voucher_history'
+    query = parse_qs(location.query)
+    assert query['plan_id'] == ['3']
+    job = db.session.get(SyncJob, int(query['sync_job'][0]))
+    assert (job.job_type, job.site_id, job.status) == ('vouchers', site.id, 'queued')
+    assert started == [(sync_worker._run_sync_job, (job.id,))]
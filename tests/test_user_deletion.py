@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from app import db
+from conftest import login
+from models import AdminSite, SalesRollup, Site, User, VendorSite, VoucherGroup, VoucherPlan
+from utils import get_sales_totals, record_group_sales
+
+
+def _user(username, user_type):
+    user = User(username=username, email=f'{username}@example.com', password_hash='x', user_type=user_type)
+    db.session.add(user)
+    return user
+
+
+def _group(site, plan, vendor, quantity, used):
+    group = VoucherGroup(site_id=site.id, plan_id=plan.id, created_by_id=vendor.id, omada_group_id=f'g-{vendor.username}',
+                         quantity=quantity, used_count=used, total_value=quantity * plan.price, created_at=datetime.utcnow())
+    db.session.add(group)
+    return group
+
+
+def test_delete_vendor_with_groups(client):
+    site = Site(site_id='s1', name='Site 1')
+    db.session.add(site)
+    admin = _user('admin', 'admin')
+    vendor = _user('vendor', 'vendor')
+    other = _user('other', 'vendor')
+    db.session.flush()
+    plan = VoucherPlan(site_id=site.id, name='1h', duration=60, duration_unit='minutes', price=2.0)
+    db.session.add(plan)
+    db.session.add_all([AdminSite(admin_id=admin.id, site_id=site.id), VendorSite(vendor_id=vendor.id, site_id=site.id),
+                        VendorSite(vendor_id=other.id, site_id=site.id)])
+    db.session.flush()
+    groups = [_group(site, plan, vendor, 10, 3), _group(site, plan, other, 5, 1)]
+    db.session.flush()
+    record_group_sales(groups)
+    db.session.commit()
+    vendor_id = vendor.id
+    
+    login(client, admin, site)
+    response = client.post(f'/admin/delete_vendor/{vendor_id}')
+    
+    assert response.status_code == 302
+    db.session.expire_all()
+    assert db.session.get(User, vendor_id) is None
+    assert VoucherGroup.query.filter_by(created_by_id=vendor_id).count() == 0
+    assert SalesRollup.query.filter_by(vendor_id=vendor_id).count() == 0
+    assert get_sales_totals(site.id) == {'total_vouchers_generated': 5, 'total_vouchers_sold': 1, 'total_revenue': 2.0}
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from models import AdminSite, SalesRollup, Site, User, Voucher, VoucherGroup, VoucherPlan
+from omada_api import omada_api
+from utils import get_sales_totals, record_group_sales, sync_voucher_statuses_from_omada
+
+
+@pytest.fixture
+def site(app):
+    site = Site(site_id='s1', name='Site 1')
+    admin = User(username='admin', email='admin@example.com', password_hash='x', user_type='admin')
+    db.session.add_all([site, admin])
+    db.session.flush()
+    db.session.add(AdminSite(admin_id=admin.id, site_id=site.id))
+    db.session.add(VoucherPlan(site_id=site.id, name='1h', duration=60, price=2.0))
+    db.session.commit()
+    return site
+
+
+def _controller(monkeypatch, groups, on_list=None):
+    """Serve groups ({id: [voucher statuses]}) as the controller's group list and details"""
+    def list_row(group_id):
+        statuses = groups[group_id]
+        return {'id': group_id, 'totalCount': len(statuses), 'unusedCount': statuses.count(0),
+                'usedCount': statuses.count(1), 'inUseCount': statuses.count(2), 'expiredCount': statuses.count(3)}
+    
+    def iter_items(func, site_id, **kwargs):
+        for group_id in groups:
+            yield list_row(group_id)
+        if on_list:
+            on_list()
+        # The last page read again, as when rows shift between page reads
+        yield list_row(list(groups)[-1])
+    
+    def get_full_voucher_group_detail(site_id, group_id, status_filter=None, deadline=None):
+        vouchers = [{'id': f'{group_id}-v{i}', 'code': f'{group_id}{i}', 'status': status}
+                    for i, status in enumerate(groups[group_id])]
+        return {'errorCode': 0, 'result': {'data': vouchers, 'groupInfo': {'name': group_id, 'durationLimit': 60}}}
+    
+    monkeypatch.setattr(omada_api, 'iter_items', iter_items)
+    monkeypatch.setattr(omada_api, 'get_full_voucher_group_detail', get_full_voucher_group_detail)
+
+
+def test_group_listed_twice_is_counted_once(site, monkeypatch):
+    plan = VoucherPlan.query.first()
+    group = VoucherGroup(site_id=site.id, plan_id=plan.id, created_by_id=User.query.first().id, omada_group_id='g1',
+                         quantity=4, unused_count=4, total_value=8.0, created_at=datetime.utcnow())
+    db.session.add(group)
+    db.session.flush()
+    record_group_sales([group])
+    db.session.commit()
+    _controller(monkeypatch, {'g1': [1, 1, 1, 0]})
+    
+    stats = sync_voucher_statuses_from_omada(site.id)
+    
+    assert stats['groups_seen'] == 1
+    assert get_sales_totals(site.id) == {'total_vouchers_generated': 4, 'total_vouchers_sold': 3, 'total_revenue': 6.0}
+
+
+def test_group_added_during_sync_is_not_imported_again(site, monkeypatch):
+    plan = VoucherPlan.query.first()
+    user_id = User.query.first().id
+    
+    def generate_group():
+        # The generation route saves its row after the sync took its snapshot
+        with db.engine.begin() as conn:
+            conn.execute(VoucherGroup.__table__.insert().values(
+                site_id=site.id, plan_id=plan.id, created_by_id=user_id, omada_group_id='g2',
+                quantity=2, unused_count=2, total_value=4.0, created_at=datetime.utcnow()))
+    
+    _controller(monkeypatch, {'g1': [0, 1], 'g2': [0, 0]}, on_list=generate_group)
+    
+    stats = sync_voucher_statuses_from_omada(site.id)
+    
+    assert stats['groups_imported'] == 1
+    assert VoucherGroup.query.filter_by(site_id=site.id, omada_group_id='g2').count() == 1
+    assert VoucherGroup.query.filter_by(site_id=site.id, omada_group_id='g1').count() == 1
+    assert Voucher.query.filter_by(site_id=site.id).count() == 2
+    assert SalesRollup.query.count() == 1
@@ -9,7 +9,7 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from flask import current_app
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 
 def generate_voucher_pdf(voucher_group, voucher_codes: List[str], format_type: str = "a4") -> bytes:
     """Generate PDF with voucher codes in A4 or 50x80mm format"""
@@ -356,32 +356,42 @@ def format_duration(duration: int, unit: str) -> str:
         return f"{duration}d"
     return f"{duration} {unit}"
 
-def get_sold_vouchers_from_omada(site_id: str, start_date=None, end_date=None):
-    """Get individual sold vouchers (status 1: in-use, 2: expired) from Omada Controller"""
-    from omada_api import OmadaAPI
+# Voucher statuses that count as sold (1: in-use, 2: expired), with their labels
+SOLD_VOUCHER_STATUSES = {1: ('Em Uso', 'warning'), 2: ('Expirado', 'danger')}
+
+# Display text and badge class of every Omada voucher status
+VOUCHER_STATUSES = {0: ('Não Utilizado', 'success'), **SOLD_VOUCHER_STATUSES}
+
+def get_sold_vouchers_from_omada(site_id: str, start_date=None, end_date=None, raise_errors: bool = False):
+    """Get individual sold vouchers (status 1: in-use, 2: expired) from Omada Controller
+    
+    With raise_errors, controller failures raise OmadaAPIError instead of
+    returning an empty or partial list.
+    """
+    from omada_api import OmadaAPI, OmadaAPIError
     from models import Site, VoucherPlan
     
     omada_api = OmadaAPI()
     sold_vouchers = []
     
+    # Let the controller filter groups by creation time (milliseconds, whole days)
+    filters = {}
+    if start_date:
+        filters['time_start'] = int(datetime.combine(start_date, datetime.min.time()).timestamp() * 1000)
+    if end_date:
+        filters['time_end'] = int(datetime.combine(end_date, datetime.max.time()).timestamp() * 1000)
+    
     try:
-        # First, get all voucher groups from Omada Controller
-        groups_response = omada_api.get_voucher_group_list(site_id)
-        
-        if not groups_response or groups_response.get('errorCode') != 0:
-            logging.error(f"Failed to get voucher groups from Omada Controller for site {site_id}")
-            return []
-        
-        voucher_groups = groups_response.get('result', {}).get('data', [])
-        logging.info(f"Found {len(voucher_groups)} voucher groups in Omada Controller")
-        
-        for group in voucher_groups:
+        # Stream every page of voucher groups created in the date range
+        group_count = 0
+        for group in omada_api.iter_items(omada_api.get_voucher_group_list, site_id, **filters):
+            group_count += 1
             group_id = group.get('id')
             group_name = group.get('name', '')
             unit_price = float(group.get('unitPrice', '0')) / 100  # Convert from cents
             created_time = group.get('createdTime', 0)
             
-            # Skip if outside date range
+            # Skip if outside date range (the controller filter already did; this is a safety net)
             if start_date or end_date:
                 group_date = datetime.fromtimestamp(created_time / 1000) if created_time else datetime.now()
                 if start_date and group_date.date() < start_date:
@@ -389,50 +399,78 @@ def get_sold_vouchers_from_omada(site_id: str, start_date=None, end_date=None):
                 if end_date and group_date.date() > end_date:
                     continue
             
-            # Get individual vouchers from this group
-            # First get in-use vouchers (status 1)
-            in_use_response = omada_api.get_individual_vouchers_from_group(site_id, group_id, status_filter=1)
-            if in_use_response and in_use_response.get('errorCode') == 0:
-                in_use_vouchers = in_use_response.get('result', {}).get('data', [])
-                for voucher in in_use_vouchers:
-                    sold_vouchers.append({
-                        'id': voucher.get('id'),
-                        'code': voucher.get('code'),
-                        'status': 1,  # In use
-                        'status_text': 'Em Uso',
-                        'status_class': 'warning',
-                        'group_id': group_id,
-                        'group_name': group_name,
-                        'unit_price': unit_price,
-                        'plan_name': _extract_plan_name_from_group(group_name),
-                        'created_at': datetime.fromtimestamp(created_time / 1000) if created_time else datetime.now()
-                    })
+            # Group counters let us skip groups with no sales, and read only
+            # one status when the other has no vouchers
+            in_use_count, expired_count = group.get('inUseCount'), group.get('expiredCount')
+            status_filter = None
+            if in_use_count is not None and expired_count is not None:
+                if not in_use_count and not expired_count:
+                    continue
+                if not (in_use_count and expired_count):
+                    status_filter = 1 if in_use_count else 2
             
-            # Then get expired vouchers (status 2)
-            expired_response = omada_api.get_individual_vouchers_from_group(site_id, group_id, status_filter=2)
-            if expired_response and expired_response.get('errorCode') == 0:
-                expired_vouchers = expired_response.get('result', {}).get('data', [])
-                for voucher in expired_vouchers:
-                    sold_vouchers.append({
+            # One paged pass per group; vouchers are classified here
+            group_vouchers = {status: [] for status in SOLD_VOUCHER_STATUSES}
+            try:
+                for voucher in omada_api.iter_group_vouchers(site_id, group_id, status_filter=status_filter):
+                    status = voucher.get('status')
+                    if status not in group_vouchers:
+                        continue
+                    status_text, status_class = SOLD_VOUCHER_STATUSES[status]
+                    group_vouchers[status].append({
                         'id': voucher.get('id'),
                         'code': voucher.get('code'),
-                        'status': 2,  # Expired
-                        'status_text': 'Expirado',
-                        'status_class': 'danger',
+                        'status': status,
+                        'status_text': status_text,
+                        'status_class': status_class,
                         'group_id': group_id,
                         'group_name': group_name,
                         'unit_price': unit_price,
                         'plan_name': _extract_plan_name_from_group(group_name),
                         'created_at': datetime.fromtimestamp(created_time / 1000) if created_time else datetime.now()
                     })
+            except OmadaAPIError as e:
+                logging.error(f"Error getting sold vouchers from group {group_id}: {str(e)}")
+                if raise_errors:
+                    raise
+            
+            # In-use vouchers first, then expired ones
+            for status in SOLD_VOUCHER_STATUSES:
+                sold_vouchers.extend(group_vouchers[status])
         
-        logging.info(f"Found {len(sold_vouchers)} sold vouchers for site {site_id}")
+        logging.info(f"Found {len(sold_vouchers)} sold vouchers in {group_count} voucher groups for site {site_id}")
         return sold_vouchers
         
     except Exception as e:
         logging.error(f"Error getting sold vouchers from Omada Controller: {str(e)}")
+        if raise_errors:
+            raise
         return []
 
+def get_sold_vouchers_with_fallback(site_id: str, start_date=None, end_date=None):
+    """Get sold vouchers, falling back to the last good result if the controller fails
+    
+    Returns (sold_vouchers, stale_since). stale_since is None for fresh data,
+    otherwise the datetime of the snapshot being served. Raises when the
+    controller fails and there is no snapshot for this query.
+    """
+    from omada_api import OmadaAPI
+    
+    omada_api = OmadaAPI()
+    params = {'site_id': site_id, 'start_date': start_date, 'end_date': end_date}
+    try:
+        sold_vouchers = get_sold_vouchers_from_omada(site_id, start_date, end_date, raise_errors=True)
+    except Exception as e:
+        snapshot = omada_api.load_snapshot('sold_vouchers', params)
+        if not snapshot:
+            raise
+        fetched_at, sold_vouchers = snapshot
+        logging.warning(f"Serving sold vouchers for site {site_id} from {fetched_at}: {str(e)}")
+        return sold_vouchers, fetched_at
+    
+    omada_api.store_snapshot('sold_vouchers', params, (datetime.now(), sold_vouchers))
+    return sold_vouchers, None
+
 def _extract_plan_name_from_group(group_name: str) -> str:
     """Extract plan name from group name (removes ID prefix and timestamp)"""
     # Group name format: XXX-plan-name_YYYYMMDD_HHMMSS
@@ -452,145 +490,539 @@ def _extract_plan_name_from_group(group_name: str) -> str:
     except:
         return group_name
 
-def generate_sales_report_data(site_id: int, start_date=None, end_date=None) -> Dict:
-    """Generate sales report data for a specific site based on actual voucher usage"""
-    from models import VoucherGroup, VoucherPlan
+def _sold_counts(row) -> tuple:
+    """(sold, in_use) of a VoucherGroup row or counts dict; sold is expired + used + in_use"""
+    get = row.get if isinstance(row, dict) else lambda name: getattr(row, name)
+    in_use = get('in_use_count') or 0
+    return (get('expired_count') or 0) + (get('used_count') or 0) + in_use, in_use
+
+def add_sales_delta(deltas: Dict, site_id: int, plan_id: int, vendor_id: int, created_at=None, price: float = 0.0,
+                    generated: int = 0, sold: int = 0, in_use: int = 0):
+    """Accumulate a change to one SalesRollup row (site, day, plan, vendor) into deltas"""
+    key = (site_id, (created_at or datetime.utcnow()).date(), plan_id, vendor_id)
+    delta = deltas.setdefault(key, [0, 0, 0, 0.0, 0.0])
+    delta[0] += generated
+    delta[1] += sold
+    delta[2] += in_use
+    delta[3] += sold * price
+    delta[4] += in_use * price
+
+def apply_sales_deltas(deltas: Dict):
+    """Add accumulated deltas to SalesRollup (flushed, not committed)
+    
+    Each row is an insert-or-increment, so concurrent writers never lose
+    each other's counts. Rows left with nothing generated (their groups
+    were deleted) are removed.
+    """
+    from models import SalesRollup
+    from app import db
+    from sqlalchemy import delete, insert, update
+    
+    counters = ('vouchers_generated', 'vouchers_sold', 'vouchers_in_use', 'revenue', 'revenue_in_use')
+    rows = [
+        {'site_id': site_id, 'day': day, 'plan_id': plan_id, 'vendor_id': vendor_id, **dict(zip(counters, delta))}
+        for (site_id, day, plan_id, vendor_id), delta in deltas.items()
+        if any(delta)
+    ]
+    if not rows:
+        return
+    
+    table = SalesRollup.__table__
+    dialect = db.engine.dialect.name
+    for start in range(0, len(rows), SYNC_WRITE_BATCH):
+        batch = rows[start:start + SYNC_WRITE_BATCH]
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            stmt = mysql_insert(SalesRollup).values(batch)
+            db.session.execute(stmt.on_duplicate_key_update({c: table.c[c] + stmt.inserted[c] for c in counters}))
+        elif dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            stmt = dialect_insert(SalesRollup).values(batch)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['site_id', 'day', 'plan_id', 'vendor_id'],
+                set_={c: table.c[c] + stmt.excluded[c] for c in counters}
+            ))
+        else:
+            for row in batch:
+                result = db.session.execute(
+                    update(SalesRollup)
+                    .where(*(table.c[k] == row[k] for k in ('site_id', 'day', 'plan_id', 'vendor_id')))
+                    .values({c: table.c[c] + row[c] for c in counters})
+                )
+                if not result.rowcount:
+                    db.session.execute(insert(SalesRollup), [row])
+    
+    if any(row['vouchers_generated'] < 0 for row in rows):
+        db.session.execute(delete(SalesRollup).where(
+            SalesRollup.site_id.in_({row['site_id'] for row in rows}),
+            SalesRollup.vouchers_generated <= 0
+        ))
+
+def record_group_sales(voucher_groups, sign: int = 1):
+    """Add whole VoucherGroups to the sales rollups, or take them out with sign=-1 (not committed)
+    
+    Call after the groups are flushed, so created_at is set.
+    """
+    deltas = {}
+    for vg in voucher_groups:
+        sold, in_use = _sold_counts(vg)
+        add_sales_delta(deltas, vg.site_id, vg.plan_id, vg.created_by_id, vg.created_at, price=vg.plan.price,
+                        generated=sign * (vg.quantity or 0), sold=sign * sold, in_use=sign * in_use)
+    apply_sales_deltas(deltas)
+
+def remove_user_sales(user):
+    """Take a user's VoucherGroups out of the sales rollups before the user is deleted (not committed)
+    
+    The groups go with the user (created_vouchers cascade), and the user's
+    SalesRollup rows would otherwise block the delete through vendor_id.
+    """
+    from models import SalesRollup
+    from app import db
+    from sqlalchemy import delete
     
-    query = VoucherGroup.query.filter_by(site_id=site_id)
+    record_group_sales(user.created_vouchers, sign=-1)
+    db.session.execute(delete(SalesRollup).where(SalesRollup.vendor_id == user.id))
+
+def rebuild_sales_rollups(site_id: Optional[int] = None) -> int:
+    """Recompute the sales rollups of one site (or all) from VoucherGroup; returns the rows written
+    
+    Revenue is recomputed at current plan prices.
+    """
+    from models import SalesRollup, VoucherGroup, VoucherPlan
+    from app import db
+    from sqlalchemy import delete
     
+    groups = db.session.query(
+        VoucherGroup.site_id, VoucherGroup.plan_id, VoucherGroup.created_by_id, VoucherGroup.created_at,
+        VoucherGroup.quantity, VoucherGroup.used_count, VoucherGroup.in_use_count, VoucherGroup.expired_count,
+        VoucherPlan.price
+    ).join(VoucherPlan, VoucherGroup.plan_id == VoucherPlan.id)
+    cleared = delete(SalesRollup)
+    if site_id is not None:
+        groups = groups.filter(VoucherGroup.site_id == site_id)
+        cleared = cleared.where(SalesRollup.site_id == site_id)
+    
+    deltas = {}
+    for vg in groups.yield_per(1000):
+        sold, in_use = _sold_counts(vg)
+        add_sales_delta(deltas, vg.site_id, vg.plan_id, vg.created_by_id, vg.created_at, price=vg.price,
+                        generated=vg.quantity or 0, sold=sold, in_use=in_use)
+    
+    db.session.execute(cleared)
+    apply_sales_deltas(deltas)
+    db.session.commit()
+    return len(deltas)
+
+def _rollup_query(site_id: int, start_date=None, end_date=None, *columns):
+    """SalesRollup query for a site and an inclusive range of days"""
+    from models import SalesRollup
+    from app import db
+    
+    query = db.session.query(*columns).select_from(SalesRollup).filter(SalesRollup.site_id == site_id)
     if start_date:
-        query = query.filter(VoucherGroup.created_at >= start_date)
+        query = query.filter(SalesRollup.day >= (start_date.date() if isinstance(start_date, datetime) else start_date))
     if end_date:
-        query = query.filter(VoucherGroup.created_at <= end_date)
+        query = query.filter(SalesRollup.day <= (end_date.date() if isinstance(end_date, datetime) else end_date))
+    return query
+
+def get_sales_totals(site_id: int, start_date=None, end_date=None) -> Dict:
+    """Dashboard totals of a site, from the sales rollups
     
-    voucher_groups = query.all()
+    As the dashboards have always counted them, sold vouchers here are
+    used + expired only; the reports also count in_use.
+    """
+    from models import SalesRollup
+    from app import db
     
-    # Calculate totals based on actually sold vouchers (expired + used + in_use)
-    total_vouchers_generated = sum(vg.quantity for vg in voucher_groups)
-    total_vouchers_sold = sum((vg.expired_count or 0) + (vg.used_count or 0) + (vg.in_use_count or 0) for vg in voucher_groups)
-    total_revenue = sum(((vg.expired_count or 0) + (vg.used_count or 0) + (vg.in_use_count or 0)) * vg.plan.price for vg in voucher_groups)
+    generated, sold, in_use, revenue, revenue_in_use = _rollup_query(
+        site_id, start_date, end_date,
+        db.func.sum(SalesRollup.vouchers_generated), db.func.sum(SalesRollup.vouchers_sold),
+        db.func.sum(SalesRollup.vouchers_in_use), db.func.sum(SalesRollup.revenue),
+        db.func.sum(SalesRollup.revenue_in_use)
+    ).one()
+    return {
+        'total_vouchers_generated': generated or 0,
+        'total_vouchers_sold': (sold or 0) - (in_use or 0),
+        'total_revenue': (revenue or 0) - (revenue_in_use or 0)
+    }
+
+def generate_sales_report_data(site_id: int, start_date=None, end_date=None) -> Dict:
+    """Generate sales report data for a specific site based on actual voucher usage
+    
+    Reads the SalesRollup rows of the requested days (by group creation
+    date, both ends inclusive), so the cost doesn't grow with history.
+    """
+    from models import SalesRollup, VoucherPlan, User
+    from app import db
+    
+    sums = (db.func.sum(SalesRollup.vouchers_generated), db.func.sum(SalesRollup.vouchers_sold), db.func.sum(SalesRollup.revenue))
     
     # Group by plan - only count sold vouchers
     plan_sales = {}
-    for vg in voucher_groups:
-        plan_name = vg.plan.name
-        sold_vouchers = (vg.expired_count or 0) + (vg.used_count or 0) + (vg.in_use_count or 0)
-        
+    plan_rows = _rollup_query(site_id, start_date, end_date, VoucherPlan.name, VoucherPlan.price, *sums)\
+        .join(VoucherPlan, SalesRollup.plan_id == VoucherPlan.id)\
+        .group_by(VoucherPlan.id, VoucherPlan.name, VoucherPlan.price)
+    for plan_name, plan_price, generated, sold, revenue in plan_rows:
         if plan_name not in plan_sales:
             plan_sales[plan_name] = {
                 'quantity_generated': 0,
                 'quantity_sold': 0,
                 'revenue': 0,
-                'plan_price': vg.plan.price
+                'plan_price': plan_price
             }
         
-        plan_sales[plan_name]['quantity_generated'] += vg.quantity
-        plan_sales[plan_name]['quantity_sold'] += sold_vouchers
-        plan_sales[plan_name]['revenue'] += sold_vouchers * vg.plan.price
+        plan_sales[plan_name]['quantity_generated'] += generated or 0
+        plan_sales[plan_name]['quantity_sold'] += sold or 0
+        plan_sales[plan_name]['revenue'] += revenue or 0
     
     # Group by vendor - only count sold vouchers
     vendor_sales = {}
-    for vg in voucher_groups:
-        vendor_name = vg.created_by.username
-        sold_vouchers = (vg.expired_count or 0) + (vg.used_count or 0) + (vg.in_use_count or 0)
-        
-        if vendor_name not in vendor_sales:
-            vendor_sales[vendor_name] = {
-                'quantity_generated': 0,
-                'quantity_sold': 0,
-                'revenue': 0
-            }
-        
-        vendor_sales[vendor_name]['quantity_generated'] += vg.quantity
-        vendor_sales[vendor_name]['quantity_sold'] += sold_vouchers
-        vendor_sales[vendor_name]['revenue'] += sold_vouchers * vg.plan.price
+    vendor_rows = _rollup_query(site_id, start_date, end_date, User.username, *sums)\
+        .join(User, SalesRollup.vendor_id == User.id)\
+        .group_by(User.id, User.username)
+    for vendor_name, generated, sold, revenue in vendor_rows:
+        vendor_sales[vendor_name] = {
+            'quantity_generated': generated or 0,
+            'quantity_sold': sold or 0,
+            'revenue': revenue or 0
+        }
     
+    # Calculate totals based on actually sold vouchers (expired + used + in_use)
     return {
-        'total_vouchers_generated': total_vouchers_generated,
-        'total_vouchers_sold': total_vouchers_sold,
-        'total_revenue': total_revenue,
+        'total_vouchers_generated': sum(p['quantity_generated'] for p in plan_sales.values()),
+        'total_vouchers_sold': sum(p['quantity_sold'] for p in plan_sales.values()),
+        'total_revenue': sum(p['revenue'] for p in plan_sales.values()),
         'plan_sales': plan_sales,
-        'vendor_sales': vendor_sales,
-        'voucher_groups': voucher_groups
+        'vendor_sales': vendor_sales
     }
 
+# Rows per bulk INSERT/UPDATE statement during syncs
+SYNC_WRITE_BATCH = 500
+
+# Site columns kept in sync with the controller
+SITE_SYNC_FIELDS = ('name', 'region', 'timezone', 'scenario', 'site_type')
+
+def _upsert_sites(rows: List[Dict]):
+    """Insert or update Site rows by site_id, with the dialect's native upsert where there is one"""
+    from models import Site
+    from app import db
+    from sqlalchemy import insert, update
+    
+    dialect = db.engine.dialect.name
+    update_columns = SITE_SYNC_FIELDS + ('last_sync',)
+    for start in range(0, len(rows), SYNC_WRITE_BATCH):
+        batch = rows[start:start + SYNC_WRITE_BATCH]
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            stmt = mysql_insert(Site).values(batch)
+            db.session.execute(stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns}))
+        elif dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            stmt = dialect_insert(Site).values(batch)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['site_id'], set_={c: stmt.excluded[c] for c in update_columns}
+            ))
+        else:
+            existing_ids = dict(db.session.query(Site.site_id, Site.id).filter(Site.site_id.in_([r['site_id'] for r in batch])))
+            new_rows = [r for r in batch if r['site_id'] not in existing_ids]
+            changed_rows = [dict(r, id=existing_ids[r['site_id']]) for r in batch if r['site_id'] in existing_ids]
+            if new_rows:
+                db.session.execute(insert(Site), new_rows)
+            if changed_rows:
+                db.session.execute(update(Site), changed_rows)
+
 def sync_sites_from_omada():
-    """Sync sites from Omada Controller"""
+    """Sync sites from Omada Controller
+    
+    Existing sites are loaded with one query; new and changed sites are
+    written with bulk upserts, and unchanged ones only get last_sync bumped.
+    """
     from omada_api import omada_api
     from models import Site
     from app import db
+    from sqlalchemy import update
     
     try:
-        # Get all sites from Omada Controller (paginated)
-        all_sites = []
-        page = 1
-        page_size = 100
-        
-        while True:
-            sites_data = omada_api.get_sites(page=page, page_size=page_size)
-            if not sites_data:
-                break
-            
-            all_sites.extend(sites_data)
-            
-            # If we got less than page_size results, we've reached the end
-            if len(sites_data) < page_size:
-                break
-                
-            page += 1
-        
-        if not all_sites:
-            logging.warning("Nenhum site encontrado no Omada Controller")
-            return 0
-        
+        existing = {
+            row.site_id: row for row in db.session.query(Site.id, Site.site_id, *(getattr(Site, f) for f in SITE_SYNC_FIELDS))
+        }
+        now = datetime.utcnow()
         synced_count = 0
         updated_count = 0
+        unchanged_ids = []
+        upserts = {}
         
-        for site_data in all_sites:
-            site = Site.query.filter_by(site_id=site_data['siteId']).first()
-            if not site:
-                # Create new site
-                site = Site(
-                    site_id=site_data['siteId'],
-                    name=site_data['name'],
-                    region=site_data.get('region', ''),
-                    timezone=site_data.get('timeZone', ''),
-                    scenario=site_data.get('scenario', ''),
-                    site_type=site_data.get('type', 0),
-                    last_sync=datetime.utcnow()
-                )
-                db.session.add(site)
+        # Stream all sites from Omada Controller, one page at a time
+        for site_data in omada_api.iter_items(omada_api.get_sites):
+            values = {
+                'site_id': site_data['siteId'],
+                'name': site_data['name'],
+                'region': site_data.get('region', ''),
+                'timezone': site_data.get('timeZone', ''),
+                'scenario': site_data.get('scenario', ''),
+                'site_type': site_data.get('type', 0)
+            }
+            site = existing.get(values['site_id'])
+            if site and all(getattr(site, f) == values[f] for f in SITE_SYNC_FIELDS):
+                unchanged_ids.append(site.id)
+                continue
+            
+            if values['site_id'] in upserts:
+                continue
+            upserts[values['site_id']] = dict(values, last_sync=now)
+            if site:
+                updated_count += 1
+                logging.debug(f"Site updated: {site_data['name']} (ID: {site_data['siteId']})")
+            else:
                 synced_count += 1
                 logging.info(f"New site added: {site_data['name']} (ID: {site_data['siteId']})")
-            else:
-                # Update existing site
-                site.name = site_data['name']
-                site.region = site_data.get('region', '')
-                site.timezone = site_data.get('timeZone', '')
-                site.scenario = site_data.get('scenario', '')
-                site.site_type = site_data.get('type', 0)
-                site.last_sync = datetime.utcnow()
-                updated_count += 1
-                logging.info(f"Site updated: {site_data['name']} (ID: {site_data['siteId']})")
         
+        if not upserts and not unchanged_ids:
+            logging.warning("Nenhum site encontrado no Omada Controller")
+            return 0
+        
+        _upsert_sites(list(upserts.values()))
+        for start in range(0, len(unchanged_ids), SYNC_WRITE_BATCH):
+            db.session.execute(
+                update(Site).where(Site.id.in_(unchanged_ids[start:start + SYNC_WRITE_BATCH])).values(last_sync=now)
+            )
         db.session.commit()
         
-        total_count = synced_count + updated_count
-        logging.info(f"Sites synced: {synced_count} new, {updated_count} updated, {total_count} total")
+        total_count = synced_count + updated_count + len(unchanged_ids)
+        logging.info(f"Sites synced: {synced_count} new, {updated_count} updated, {len(unchanged_ids)} unchanged, {total_count} total")
         return total_count
         
     except Exception as e:
         logging.error(f"Error syncing sites: {str(e)}")
+        db.session.rollback()
         raise e
 
-def sync_voucher_statuses_from_omada(site_id: int):
+def _group_fingerprint(group_data: Dict) -> Optional[str]:
+    """Summarize the status counters of a group list row; None if the controller didn't send them"""
+    counters = [group_data.get(field) for field in ('totalCount', 'unusedCount', 'usedCount', 'inUseCount', 'expiredCount')]
+    if any(counter is None for counter in counters):
+        return None
+    return ':'.join(str(counter) for counter in counters)
+
+def _voucher_status_counts(voucher_data_list: List[Dict]) -> Dict:
+    """Count the vouchers of a group detail by status, as stored on VoucherGroup"""
+    return {
+        'unused_count': sum(1 for v in voucher_data_list if v.get('status') == 0),
+        'used_count': sum(1 for v in voucher_data_list if v.get('status') == 1),
+        'in_use_count': sum(1 for v in voucher_data_list if v.get('status') == 2),
+        'expired_count': sum(1 for v in voucher_data_list if v.get('status') == 3)
+    }
+
+def _voucher_status_values(row, status: int, now: datetime) -> Dict:
+    """Voucher columns to set when sync sees status; row is the stored voucher, if any"""
+    values = {'status': status, 'status_changed_at': now}
+    if status in (1, 2) and not (row and row.used_at):
+        values['used_at'] = now
+    if status == 2 and not (row and row.expired_at):
+        values['expired_at'] = now
+    return values
+
+def _sync_group_vouchers(site_id: int, group_vouchers: Dict[str, List[Dict]]):
+    """Bring the Voucher rows of some groups in line with their controller detail
+    
+    group_vouchers maps omada_group_id to the group's full voucher list.
+    New vouchers are inserted, status changes are stamped, and vouchers the
+    controller no longer lists are deleted, all in bulk statements.
+    """
+    from models import Voucher, VoucherGroup
+    from app import db
+    from sqlalchemy import delete, insert, update
+    
+    group_ids = dict(db.session.query(VoucherGroup.omada_group_id, VoucherGroup.id).filter(
+        VoucherGroup.site_id == site_id, VoucherGroup.omada_group_id.in_(list(group_vouchers))
+    ))
+    existing = {
+        row.omada_voucher_id: row for row in db.session.query(
+            Voucher.id, Voucher.omada_voucher_id, Voucher.status, Voucher.used_at, Voucher.expired_at
+        ).filter(Voucher.voucher_group_id.in_(list(group_ids.values())))
+    }
+    
+    now = datetime.now()
+    inserts = []
+    updates = []
+    seen = set()
+    for omada_group_id, vouchers in group_vouchers.items():
+        voucher_group_id = group_ids.get(omada_group_id)
+        if not voucher_group_id:
+            continue
+        for v in vouchers:
+            omada_voucher_id, status = v.get('id'), v.get('status')
+            if not omada_voucher_id or status is None or omada_voucher_id in seen:
+                continue
+            seen.add(omada_voucher_id)
+            row = existing.get(omada_voucher_id)
+            if row and row.status == status:
+                continue
+            
+            values = _voucher_status_values(row, status, now)
+            if row:
+                updates.append(dict({'used_at': row.used_at, 'expired_at': row.expired_at}, id=row.id, **values))
+            else:
+                inserts.append(dict({'used_at': None, 'expired_at': None}, site_id=site_id,
+                                    voucher_group_id=voucher_group_id, omada_voucher_id=omada_voucher_id,
+                                    code=v.get('code') or '', created_at=now, **values))
+    
+    removed = [row.id for omada_voucher_id, row in existing.items() if omada_voucher_id not in seen]
+    for start in range(0, max(len(inserts), len(updates), len(removed)), SYNC_WRITE_BATCH):
+        end = start + SYNC_WRITE_BATCH
+        if inserts[start:end]:
+            # render_nulls keeps rows with and without timestamps in one statement
+            db.session.execute(insert(Voucher).execution_options(render_nulls=True), inserts[start:end])
+        if updates[start:end]:
+            db.session.execute(update(Voucher), updates[start:end])
+        if removed[start:end]:
+            db.session.execute(delete(Voucher).where(Voucher.id.in_(removed[start:end])))
+
+def lookup_vouchers(code: str, prefix: bool = False, site_ids: Optional[List[int]] = None, limit: int = 50):
+    """Find vouchers by code (exact, or starting with code) among the given sites
+    
+    Uses the indexed Voucher.code column, so it only sees vouchers that
+    sync has already read.
+    """
+    from models import Voucher, VoucherGroup
+    from sqlalchemy.orm import joinedload
+    
+    query = Voucher.query.options(
+        joinedload(Voucher.site),
+        joinedload(Voucher.voucher_group).joinedload(VoucherGroup.plan),
+        joinedload(Voucher.voucher_group).joinedload(VoucherGroup.created_by)
+    )
+    if site_ids is not None:
+        query = query.filter(Voucher.site_id.in_(site_ids))
+    if prefix:
+        query = query.filter(Voucher.code.startswith(code, autoescape=True)).order_by(Voucher.code)
+    else:
+        query = query.filter(Voucher.code == code)
+    return query.limit(limit).all()
+
+def refresh_voucher_from_omada(voucher) -> bool:
+    """Re-read one voucher's status from the Omada Controller; returns whether it was found"""
+    from omada_api import omada_api
+    from app import db
+    
+    site_key = voucher.site.site_id
+    omada_group_id = voucher.voucher_group.omada_group_id
+    omada_api.invalidate_cache(site_key, [omada_group_id])
+    result = omada_api.get_individual_vouchers_from_group(site_key, omada_group_id, page_size=100, search_key=voucher.code)
+    if not result or result.get('errorCode') != 0:
+        return False
+    
+    for v in result.get('result', {}).get('data') or []:
+        if v.get('id') != voucher.omada_voucher_id:
+            continue
+        if v.get('status') is not None and v.get('status') != voucher.status:
+            for column, value in _voucher_status_values(voucher, v['status'], datetime.now()).items():
+                setattr(voucher, column, value)
+            db.session.commit()
+        return True
+    return False
+
+def filter_unclosed_vouchers(site_id: int, vouchers: List[Dict]) -> List[Dict]:
+    """Vouchers (dicts with the Omada 'id') not yet included in a cash register closing of the site
+    
+    Looks the ids up in the CashRegisterVoucher ledger, SYNC_WRITE_BATCH at
+    a time, so the cost follows the number of vouchers checked rather than
+    the number of past closings.
+    """
+    from models import CashRegisterVoucher
+    from app import db
+    
+    voucher_ids = list({v.get('id') for v in vouchers if v.get('id')})
+    closed_ids = set()
+    for start in range(0, len(voucher_ids), SYNC_WRITE_BATCH):
+        closed_ids.update(db.session.scalars(
+            db.select(CashRegisterVoucher.omada_voucher_id).where(
+                CashRegisterVoucher.site_id == site_id,
+                CashRegisterVoucher.omada_voucher_id.in_(voucher_ids[start:start + SYNC_WRITE_BATCH])
+            )
+        ))
+    return [v for v in vouchers if v.get('id') not in closed_ids]
+
+def record_closed_vouchers(cash_register, vouchers: List[Dict]):
+    """Add a closing's vouchers to the CashRegisterVoucher ledger (flushed, not committed)
+    
+    The unique (site_id, omada_voucher_id) constraint makes the flush raise
+    IntegrityError if another closing already took one of the vouchers.
+    """
+    from models import CashRegisterVoucher
+    from app import db
+    from sqlalchemy import insert
+    
+    db.session.flush()  # cash_register.id
+    rows = [
+        {'cash_register_id': cash_register.id, 'site_id': cash_register.site_id,
+         'omada_voucher_id': v['id'], 'code': v.get('code')}
+        for v in {v['id']: v for v in vouchers if v.get('id')}.values()
+    ]
+    for start in range(0, len(rows), SYNC_WRITE_BATCH):
+        db.session.execute(insert(CashRegisterVoucher), rows[start:start + SYNC_WRITE_BATCH])
+
+def _voucher_group_status(counts: Dict) -> str:
+    """VoucherGroup.status for the given status counts"""
+    return 'sold' if (counts['expired_count'] + counts['used_count'] + counts['in_use_count']) > 0 else 'generated'
+
+def _insert_imported_groups(site_id: int, rows: List[Dict], pending_vouchers: Dict, sales_deltas: Dict, plan_prices: Dict) -> int:
+    """Insert groups imported by a sync, skipping any another writer added since the sync's snapshot; returns the number skipped
+    
+    A group generated while the sync runs gets its row from the generation
+    route; the unique (site_id, omada_group_id) index backs this check.
+    """
+    from models import VoucherGroup
+    from app import db
+    from sqlalchemy import insert, select
+    
+    taken = set(db.session.scalars(select(VoucherGroup.omada_group_id).where(
+        VoucherGroup.site_id == site_id, VoucherGroup.omada_group_id.in_([row['omada_group_id'] for row in rows])
+    )))
+    rows = [row for row in rows if row['omada_group_id'] not in taken]
+    for omada_group_id in taken:
+        pending_vouchers.pop(omada_group_id, None)
+    if not rows:
+        return len(taken)
+    
+    db.session.execute(insert(VoucherGroup), rows)
+    for row in rows:
+        sold, in_use = _sold_counts(row)
+        add_sales_delta(sales_deltas, site_id, row['plan_id'], row['created_by_id'], row['created_at'],
+                        price=plan_prices.get(row['plan_id'], 0.0), generated=row['quantity'], sold=sold, in_use=in_use)
+    return len(taken)
+
+def sync_voucher_statuses_from_omada(site_id: int, max_workers: Optional[int] = None, force: bool = False,
+                                     progress: Optional[Callable[[Dict], None]] = None, deadline: Optional[float] = None):
     """
     Sync voucher statuses from Omada Controller for a specific site
     Also discovers and imports voucher groups that exist in Omada but not locally
+    
+    Group details are fetched concurrently, at most max_workers at a time
+    (defaults to OMADA_SYNC_CONCURRENCY). Groups whose list counters match
+    the fingerprint stored at their last sync are skipped unless force is set.
+    The site's groups are loaded with one query up front and written back
+    with bulk INSERTs/UPDATEs of SYNC_WRITE_BATCH rows, each batch committed
+    on its own. The Voucher rows of every group read in detail are brought
+    up to date as well, and sold count changes are added to the site's
+    SalesRollup rows in the same batch.
+    
+    Returns a dict of counters (groups_seen, groups_changed, groups_imported,
+    groups_synced), or False if the sync failed. progress, if given, is
+    called with the counters so far as groups are listed. With a deadline
+    (a time.monotonic() value), the sync fails instead of starting another
+    group or page read past it; batches already written stay.
     """
-    from omada_api import omada_api
+    from omada_api import omada_api, check_deadline
     from models import Site, VoucherGroup, VoucherPlan, User, AdminSite
     from app import db
+    from sqlalchemy import insert, update
     import logging
     
     try:
@@ -601,170 +1033,231 @@ def sync_voucher_statuses_from_omada(site_id: int):
             return False
         
         logging.info(f"Syncing voucher statuses for site: {site.name} (ID: {site_id})")
+        # Plain value for the API calls: pool threads must not touch ORM objects
+        site_key = site.site_id
         
-        # Get ALL voucher groups from Omada Controller (paginated)
-        all_voucher_groups = []
-        page = 1
-        page_size = 100
+        # Everything the sync needs to know about local groups, in one query
+        # (without the voucher_codes blobs)
+        local_groups = {
+            row.omada_group_id: row for row in db.session.query(
+                VoucherGroup.id, VoucherGroup.omada_group_id, VoucherGroup.sync_fingerprint,
+                VoucherGroup.unused_count, VoucherGroup.used_count,
+                VoucherGroup.in_use_count, VoucherGroup.expired_count,
+                VoucherGroup.plan_id, VoucherGroup.created_by_id, VoucherGroup.created_at
+            ).filter(VoucherGroup.site_id == site_id, VoucherGroup.omada_group_id.isnot(None))
+        }
+        plan_prices = dict(db.session.query(VoucherPlan.id, VoucherPlan.price).filter(VoucherPlan.site_id == site_id))
         
-        while True:
-            response = omada_api.get_voucher_groups(site.site_id, page=page, page_size=page_size)
-            
-            if not response or response.get('errorCode') != 0:
-                if page == 1:
-                    logging.error(f"Failed to get voucher groups from Omada Controller")
-                    return False
-                else:
-                    break
-            
-            result = response.get('result', {})
-            data = result.get('data', [])
-            
-            if not data:
-                break
+        total_synced = 0
+        new_groups_imported = 0
+        groups_seen = 0
+        groups_unchanged = 0
+        groups_changed = 0
+        unchanged_ids = []
+        pending_updates = []
+        pending_inserts = []
+        pending_vouchers = {}
+        sales_deltas = {}
+        listed_ids = set()
+        
+        def current_stats():
+            return {
+                'groups_seen': groups_seen,
+                'groups_changed': groups_changed + new_groups_imported,
+                'groups_imported': new_groups_imported,
+                'groups_synced': total_synced
+            }
+        
+        def write_batches(final: bool = False):
+            """Send queued writes as bulk statements once a batch is full (or everything, at the end)"""
+            nonlocal new_groups_imported, total_synced
+            queues = (unchanged_ids, pending_updates, pending_inserts, pending_vouchers)
+            if not final and all(len(queue) < SYNC_WRITE_BATCH for queue in queues):
+                return
+            if unchanged_ids:
+                db.session.execute(
+                    update(VoucherGroup).where(VoucherGroup.id.in_(unchanged_ids)).values(last_sync=datetime.now())
+                )
+                unchanged_ids.clear()
+            if pending_updates:
+                db.session.execute(update(VoucherGroup), pending_updates)
+                pending_updates.clear()
+            if pending_inserts:
+                skipped = _insert_imported_groups(site_id, pending_inserts, pending_vouchers, sales_deltas, plan_prices)
+                new_groups_imported -= skipped
+                total_synced -= skipped
+                pending_inserts.clear()
+            # Vouchers last, once their groups have rows
+            if pending_vouchers:
+                _sync_group_vouchers(site_id, pending_vouchers)
+                pending_vouchers.clear()
+            # Rollup deltas go in the same transaction as the counters and
+            # fingerprints they come from: a sync that fails later keeps
+            # both or neither
+            apply_sales_deltas(sales_deltas)
+            sales_deltas.clear()
+            db.session.commit()
+        
+        def changed_groups():
+            """Stream ALL voucher groups (paginated), yielding those whose counters changed"""
+            nonlocal groups_seen, groups_unchanged
+            for group_data in omada_api.iter_items(omada_api.get_voucher_groups, site_key):
+                check_deadline(deadline)
+                omada_group_id = group_data.get('id')
+                # Rows shifting between page reads can list a group twice
+                if not omada_group_id or omada_group_id in listed_ids:
+                    continue
+                listed_ids.add(omada_group_id)
+                groups_seen += 1
+                if progress:
+                    progress(current_stats())
+                fingerprint = _group_fingerprint(group_data)
                 
-            all_voucher_groups.extend(data)
-            
-            # Check if there are more pages
-            total_rows = result.get('totalRows', 0)
-            if len(all_voucher_groups) >= total_rows:
-                break
+                if not force and fingerprint:
+                    local_group = local_groups.get(omada_group_id)
+                    if local_group and local_group.sync_fingerprint == fingerprint:
+                        unchanged_ids.append(local_group.id)
+                        groups_unchanged += 1
+                        continue
                 
-            page += 1
+                yield omada_group_id, fingerprint
         
-        logging.info(f"Found {len(all_voucher_groups)} voucher groups in Omada Controller")
+        def fetch_group_detail(group):
+            return omada_api.get_full_voucher_group_detail(site_key, group[0], deadline=deadline)
         
-        total_synced = 0
-        new_groups_imported = 0
+        # Plan and user for imported groups, looked up once per sync
+        import_plans = {}
+        import_user = None
+        
+        def get_import_user():
+            nonlocal import_user
+            if import_user is None:
+                # Prefer admin users for this site, then master or any user
+                admin_site = AdminSite.query.filter_by(site_id=site_id).first()
+                import_user = (admin_site and User.query.get(admin_site.admin_id) or
+                               User.query.filter_by(user_type='master').first() or
+                               User.query.filter_by(user_type='admin').first() or
+                               User.query.first())
+            return import_user
         
-        for group_data in all_voucher_groups:
-            omada_group_id = group_data.get('id')
-            if not omada_group_id:
+        # Detail calls run on a bounded thread pool; DB writes stay on this thread
+        for (omada_group_id, fingerprint), group_details in omada_api.iter_concurrent(fetch_group_detail, changed_groups(), max_workers=max_workers):
+            write_batches()
+            
+            if not group_details or group_details.get('errorCode') != 0:
+                logging.error(f"Error updating voucher group {omada_group_id}: failed to get group detail")
                 continue
             
-            # Find the corresponding voucher group in our database
-            voucher_group = VoucherGroup.query.filter_by(omada_group_id=omada_group_id).first()
+            result_data = group_details.get('result', {})
+            voucher_data_list = result_data.get('data', [])
+            local_group = local_groups.get(omada_group_id)
             
-            if not voucher_group:
+            if not local_group:
                 # This voucher group exists in Omada but not locally - import it
                 logging.info(f"Importing missing voucher group {omada_group_id}")
+                group_info = result_data.get('groupInfo', {})
                 
-                # Get detailed information about this group
-                group_details = omada_api.get_voucher_group_detail(site.site_id, omada_group_id)
-                
-                if group_details and group_details.get('errorCode') == 0:
-                    result_data = group_details.get('result', {})
-                    group_info = result_data.get('groupInfo', {})
-                    voucher_data_list = result_data.get('data', [])
+                if voucher_data_list:
+                    # Create or find a suitable plan
+                    plan_name = f"Importado - {group_info.get('name', 'Sem Nome')}"[:50]
+                    duration_limit = group_info.get('durationLimit', 60)
+                    data_limit = group_info.get('dataLimit', 0)
                     
-                    if voucher_data_list:
-                        # Create or find a suitable plan
-                        plan_name = f"Importado - {group_info.get('name', 'Sem Nome')}"[:50]
-                        duration_limit = group_info.get('durationLimit', 60)
-                        data_limit = group_info.get('dataLimit', 0)
-                        
-                        # Try to find existing plan with similar characteristics
+                    # Try to find existing plan with similar characteristics
+                    existing_plan = import_plans.get(duration_limit)
+                    if not existing_plan:
                         existing_plan = VoucherPlan.query.filter_by(
                             site_id=site_id,
                             duration=duration_limit
                         ).first()
+                    
+                    if not existing_plan:
+                        # Create new plan for imported vouchers
+                        existing_plan = VoucherPlan(
+                            name=plan_name,
+                            duration=duration_limit,
+                            price=0.00,  # Unknown price for imported vouchers
+                            site_id=site_id,
+                            is_active=True,
+                            data_quota=data_limit,  # Correct field name
+                            code_length=8,
+                            limit_type=2  # Unlimited type
+                        )
+                        db.session.add(existing_plan)
+                        # Committed right away (which also gets the ID), so the sync
+                        # holds no write transaction open between batches
+                        db.session.commit()
+                    import_plans[duration_limit] = existing_plan
+                    
+                    if get_import_user():
+                        # Extract voucher codes
+                        voucher_codes = [v.get('code', f'CODE-{i}') for i, v in enumerate(voucher_data_list)]
+                        counts = _voucher_status_counts(voucher_data_list)
                         
-                        if not existing_plan:
-                            # Create new plan for imported vouchers
-                            existing_plan = VoucherPlan(
-                                name=plan_name,
-                                duration=duration_limit,
-                                price=0.00,  # Unknown price for imported vouchers
-                                site_id=site_id,
-                                is_active=True,
-                                data_quota=data_limit,  # Correct field name
-                                code_length=8,
-                                limit_type=2  # Unlimited type
-                            )
-                            db.session.add(existing_plan)
-                            db.session.flush()  # Get the ID
-                        
-                        # Find appropriate user to attribute import to
-                        import_user = None
-                        
-                        # Prefer admin users for this site
-                        admin_sites = AdminSite.query.filter_by(site_id=site_id).all()
-                        if admin_sites:
-                            import_user = User.query.get(admin_sites[0].admin_id)
-                        
-                        # Fallback to master or any user
-                        if not import_user:
-                            import_user = (User.query.filter_by(user_type='master').first() or
-                                         User.query.filter_by(user_type='admin').first() or
-                                         User.query.first())
-                        
-                        if import_user:
-                            # Extract voucher codes
-                            voucher_codes = [v.get('code', f'CODE-{i}') for i, v in enumerate(voucher_data_list)]
-                            
-                            # Count statuses
-                            unused_count = sum(1 for v in voucher_data_list if v.get('status') == 0)
-                            used_count = sum(1 for v in voucher_data_list if v.get('status') == 1)
-                            in_use_count = sum(1 for v in voucher_data_list if v.get('status') == 2)
-                            expired_count = sum(1 for v in voucher_data_list if v.get('status') == 3)
-                            
-                            # Calculate total value based on quantity and plan price
-                            total_value = len(voucher_data_list) * existing_plan.price
-                            
-                            # Create voucher group
-                            voucher_group = VoucherGroup(
-                                plan_id=existing_plan.id,
-                                site_id=site_id,
-                                quantity=len(voucher_data_list),
-                                omada_group_id=omada_group_id,
-                                created_by_id=import_user.id,
-                                voucher_codes=voucher_codes,
-                                total_value=total_value,
-                                created_at=datetime.now(),
-                                unused_count=unused_count,
-                                used_count=used_count,
-                                in_use_count=in_use_count,
-                                expired_count=expired_count,
-                                last_sync=datetime.now(),
-                                status='sold' if (expired_count + used_count + in_use_count) > 0 else 'generated'
-                            )
-                            db.session.add(voucher_group)
-                            new_groups_imported += 1
-                            
-                            logging.info(f"Imported voucher group {omada_group_id} with {len(voucher_data_list)} vouchers")
-            
-            if voucher_group:
-                # Update existing voucher group with fresh data from Omada
-                try:
-                    group_details = omada_api.get_voucher_group_detail(site.site_id, omada_group_id)
-                    if group_details and group_details.get('errorCode') == 0:
-                        voucher_data_list = group_details.get('result', {}).get('data', [])
-                        
-                        # Count vouchers by status
-                        unused_count = sum(1 for v in voucher_data_list if v.get('status') == 0)
-                        used_count = sum(1 for v in voucher_data_list if v.get('status') == 1)
-                        in_use_count = sum(1 for v in voucher_data_list if v.get('status') == 2)
-                        expired_count = sum(1 for v in voucher_data_list if v.get('status') == 3)
-                        
-                        # Update counts
-                        voucher_group.unused_count = unused_count
-                        voucher_group.used_count = used_count
-                        voucher_group.in_use_count = in_use_count
-                        voucher_group.expired_count = expired_count
-                        voucher_group.last_sync = datetime.now()
-                        
-                        # Update voucher codes if we have real ones
-                        real_codes = [v.get('code') for v in voucher_data_list if v.get('code') and not v.get('code', '').startswith('OMADA-')]
-                        if real_codes and len(real_codes) == len(voucher_data_list):
-                            voucher_group.voucher_codes = real_codes
-                        
-                        # Update status
-                        voucher_group.status = 'sold' if (expired_count + used_count + in_use_count) > 0 else 'generated'
+                        # Calculate total value based on quantity and plan price
+                        total_value = len(voucher_data_list) * existing_plan.price
                         
+                        # Create voucher group
+                        created_at = datetime.now()
+                        pending_inserts.append(dict(
+                            plan_id=existing_plan.id,
+                            site_id=site_id,
+                            quantity=len(voucher_data_list),
+                            omada_group_id=omada_group_id,
+                            created_by_id=import_user.id,
+                            voucher_codes=voucher_codes,
+                            total_value=total_value,
+                            created_at=created_at,
+                            last_sync=datetime.now(),
+                            sync_fingerprint=fingerprint,
+                            status=_voucher_group_status(counts),
+                            **counts
+                        ))
+                        pending_vouchers[omada_group_id] = voucher_data_list
+                        plan_prices.setdefault(existing_plan.id, existing_plan.price)
+                        new_groups_imported += 1
                         total_synced += 1
                         
-                except Exception as e:
-                    logging.error(f"Error updating voucher group {omada_group_id}: {str(e)}")
+                        logging.info(f"Imported voucher group {omada_group_id} with {len(voucher_data_list)} vouchers")
+                continue
+            
+            # Update existing voucher group with fresh data from Omada
+            try:
+                counts = _voucher_status_counts(voucher_data_list)
+                
+                # Did any voucher change status since the last sync?
+                previous_counts = (local_group.unused_count, local_group.used_count,
+                                   local_group.in_use_count, local_group.expired_count)
+                if previous_counts != (counts['unused_count'], counts['used_count'],
+                                       counts['in_use_count'], counts['expired_count']):
+                    groups_changed += 1
+                    (sold, in_use), (previous_sold, previous_in_use) = _sold_counts(counts), _sold_counts(local_group)
+                    add_sales_delta(sales_deltas, site_id, local_group.plan_id, local_group.created_by_id, local_group.created_at,
+                                    price=plan_prices.get(local_group.plan_id, 0),
+                                    sold=sold - previous_sold, in_use=in_use - previous_in_use)
+                
+                values = dict(
+                    counts,
+                    id=local_group.id,
+                    last_sync=datetime.now(),
+                    sync_fingerprint=fingerprint,
+                    status=_voucher_group_status(counts)
+                )
+                
+                # Update voucher codes if we have real ones
+                real_codes = [v.get('code') for v in voucher_data_list if v.get('code') and not v.get('code', '').startswith('OMADA-')]
+                if real_codes and len(real_codes) == len(voucher_data_list):
+                    values['voucher_codes'] = real_codes
+                
+                pending_updates.append(values)
+                pending_vouchers[omada_group_id] = voucher_data_list
+                total_synced += 1
+                
+            except Exception as e:
+                logging.error(f"Error updating voucher group {omada_group_id}: {str(e)}")
+        
+        write_batches(final=True)
+        logging.info(f"Found {groups_seen} voucher groups in Omada Controller, {groups_unchanged} unchanged since last sync")
         
         # Commit all changes
         db.session.commit()
@@ -773,7 +1266,10 @@ def sync_voucher_statuses_from_omada(site_id: int):
             logging.info(f"Imported {new_groups_imported} new voucher groups from Omada Controller")
         
         logging.info(f"Successfully synced {total_synced} voucher groups for site {site_id}")
-        return True
+        stats = current_stats()
+        if progress:
+            progress(stats)
+        return stats
         
     except Exception as e:
         logging.error(f"Error syncing voucher statuses from Omada: {str(e)}")